@@ -2,6 +2,8 @@
 # coding=utf-8
 # ------------------------------------------------------------------------
 
+from __future__ import with_statement
+
 import re
 import copy
 
@@ -229,6 +231,21 @@ class ItemEditor(admin.ModelAdmin):
     # The next two add support for sending a "saving done" signal as soon
     # as all relevant data have been saved (especially all foreign key relations)
     # This can be used to keep functionality dependend on item content happy.
+    def save_formset(self, request, form, formset, change):
+        # The content blocks are saved in bulk, itemeditor_post_save_related
+        # is sent afterwards
+        from feincms.models import bulk_content_save
+
+        with bulk_content_save(form.instance) as bulk:
+            super(ItemEditor, self).save_formset(request, form, formset, change)
+
+            # Record the regions of all added, changed, moved and deleted
+            # content blocks
+            for f in formset.forms:
+                if f.has_changed():
+                    bulk.regions.add(f.initial.get('region'))
+                    bulk.regions.add(getattr(f, 'cleaned_data', {}).get('region'))
+
     # NOTE: These two can (and probably should) be replaced by overriding
     # `save_related` as soon as we don't depend on Django<1.4 any more.
     def response_add(self, request, obj, *args, **kwargs):
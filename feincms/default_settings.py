@@ -112,6 +112,17 @@ FEINCMS_TIDY_FUNCTION = getattr(settings, 'FEINCMS_TIDY_FUNCTION',
 FEINCMS_REVERSE_MONKEY_PATCH = getattr(settings, 'FEINCMS_REVERSE_MONKEY_PATCH',
     False)
 
+# ------------------------------------------------------------------------
+#: Number of threads used by ``feincms_render_region`` to render content blocks
+#: concurrently. Only content blocks of content types setting
+#: ``feincms_render_threadsafe = True`` are handed to the thread pool, each
+#: with a copy of the template context. Worker threads use
+#: database connections of their own and therefore do not see changes made
+#: in the request's uncommitted transaction. The thread pool of the
+#: ``multiprocessing`` module is used, which requires Python 2.6 or later.
+#: ``0`` disables concurrent rendering.
+FEINCMS_RENDER_THREADS = getattr(settings, 'FEINCMS_RENDER_THREADS', 0)
+
 # ------------------------------------------------------------------------
 #: Makes the page handling mechanism try to find a cms page with that
 #: path if it encounters a page not found situation. This allows for nice
@@ -134,3 +145,49 @@ FEINCMS_MEDIAFILE_OVERWRITE = getattr(settings, 'FEINCMS_MEDIAFILE_OVERWRITE',
 FEINCMS_THUMBNAIL_DIR = getattr(settings, 'FEINCMS_THUMBNAIL_DIR', '_thumbs/')
 
 # ------------------------------------------------------------------------
+#: Timeout in seconds for sharing the map between content types and Django's
+#: content type IDs of the ``ct_tracker`` extension between processes using
+#: Django's cache. Freshly started processes do not have to query the content
+#: types then. ``None`` disables the shared cache.
+FEINCMS_CT_TRACKER_CACHE_TIMEOUT = getattr(settings,
+    'FEINCMS_CT_TRACKER_CACHE_TIMEOUT', None)
+
+# ------------------------------------------------------------------------
+#: Resolve paths in ``Page.objects.best_match_for_path`` using an in-process
+#: index of the URLs of all active pages instead of querying the database.
+#: Requires a cache backend shared by all processes, see
+#: :mod:`feincms.module.page.url_index`.
+FEINCMS_PAGE_URL_INDEX = getattr(settings, 'FEINCMS_PAGE_URL_INDEX', False)
+
+# ------------------------------------------------------------------------
+#: Timeout in seconds for caching that no page matches a path in
+#: ``Page.objects.page_for_path`` and ``Page.objects.best_match_for_path``.
+#: Cached misses are dropped when any page is saved or deleted and expire
+#: when the next page is published or unpublished (if the ``datepublisher``
+#: extension is active). ``None`` disables caching of misses.
+FEINCMS_PAGE_MISS_CACHE_TIMEOUT = getattr(settings,
+    'FEINCMS_PAGE_MISS_CACHE_TIMEOUT', None)
+
+# ------------------------------------------------------------------------
+#: Update the ``_cached_url`` of all descendants using batched ``UPDATE``
+#: statements when the URL of a page changes, instead of saving every
+#: descendant. Much faster for large trees, but no signals are sent for the
+#: descendants and their ``save`` methods are not called.
+FEINCMS_PAGE_BULK_URL_UPDATE = getattr(settings,
+    'FEINCMS_PAGE_BULK_URL_UPDATE', False)
+
+# ------------------------------------------------------------------------
+#: Determine whether pages and their ancestors are active using a cached set
+#: of all effectively visible pages instead of one query per check. See
+#: :mod:`feincms.module.page.visibility`.
+FEINCMS_PAGE_VISIBILITY_CACHE = getattr(settings,
+    'FEINCMS_PAGE_VISIBILITY_CACHE', False)
+
+# ------------------------------------------------------------------------
+#: Number of pages kept in a process-local LRU cache in front of the page
+#: object cache, see :mod:`feincms.module.page.object_cache`. ``0`` disables
+#: the process-local cache.
+FEINCMS_PAGE_OBJECT_CACHE_SIZE = getattr(settings,
+    'FEINCMS_PAGE_OBJECT_CACHE_SIZE', 0)
+
+# ------------------------------------------------------------------------
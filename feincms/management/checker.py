@@ -1,5 +1,7 @@
 from django.core.management.color import color_style
-from django.db import connection
+from django.db import connection, transaction
+from django.db.backends.util import truncate_name
+from django.db.models.fields import FieldDoesNotExist
 
 
 def check_database_schema(cls, module_name):
@@ -10,6 +12,10 @@ def check_database_schema(cls, module_name):
     where the extension might be activated after syncdb has been run for the
     first time.
 
+    The function reports missing recommended indexes (see
+    ``missing_indexes``) on the passed class and on all its content types
+    too.
+
     Please note that you have to connect the return value using strong
     references. Here's an example how to do this::
 
@@ -34,22 +40,142 @@ def check_database_schema(cls, module_name):
             if field.column not in existing_columns:
                 missing_columns.append(field)
 
-        if not missing_columns:
+        style = color_style()
+
+        if missing_columns:
+            print style.ERROR('The following columns seem to be missing in the database table %s:' % cls._meta.db_table)
+            for field in missing_columns:
+                print u'%s:%s%s' % (
+                    style.SQL_KEYWORD(field.column),
+                    ' ' * (25 - len(field.column)),
+                    u'%s.%s' % (field.__class__.__module__, field.__class__.__name__),
+                    )
+
+            print style.NOTICE('\nPlease consult the output of `python manage.py sql %s` to'
+                ' find out what the correct column types are. (Or use south, which is what'
+                ' you should be doing anyway.)\n' % (
+                cls._meta.app_label,
+                ))
             return
 
-        style = color_style()
+        missing = []
+        for model in [cls] + list(getattr(cls, '_feincms_content_types', ())):
+            missing.extend(missing_indexes(model))
 
-        print style.ERROR('The following columns seem to be missing in the database table %s:' % cls._meta.db_table)
-        for field in missing_columns:
-            print u'%s:%s%s' % (
-                style.SQL_KEYWORD(field.column),
-                ' ' * (25 - len(field.column)),
-                u'%s.%s' % (field.__class__.__module__, field.__class__.__name__),
-                )
-
-        print style.NOTICE('\nPlease consult the output of `python manage.py sql %s` to'
-            ' find out what the correct column types are. (Or use south, which is what'
-            ' you should be doing anyway.)\n' % (
-            cls._meta.app_label,
-            ))
+        if missing:
+            print style.NOTICE('The following recommended indexes seem to be missing:')
+            for sql in missing:
+                print style.SQL_KEYWORD(sql + ';')
+            print
     return _fn
+
+
+def recommended_index_columns(model):
+    """
+    Returns a list of column tuples for all indexes recommended for the
+    passed model. The indexes are defined by listing tuples of field names in
+    the ``feincms_indexes`` attribute of the model.
+    """
+
+    indexes = []
+    for fields in getattr(model, 'feincms_indexes', ()):
+        try:
+            indexes.append(tuple(model._meta.get_field(name).column for name in fields))
+        except FieldDoesNotExist:
+            # The field might be added by an extension which is not in use
+            continue
+    return indexes
+
+
+def get_indexes(cursor, table_name):
+    """
+    Returns a list of column tuples, one for every index on the passed table,
+    or ``None`` if the database backend is not supported. Django's own
+    introspection only knows about single column indexes.
+    """
+
+    vendor = connection.vendor
+    qn = connection.ops.quote_name
+    indexes = {}
+
+    if vendor == 'sqlite':
+        cursor.execute('PRAGMA index_list(%s)' % qn(table_name))
+        for row in cursor.fetchall():
+            cursor.execute('PRAGMA index_info(%s)' % qn(row[1]))
+            indexes[row[1]] = [(seqno, column) for seqno, cid, column in cursor.fetchall()]
+    elif vendor == 'postgresql':
+        cursor.execute('SELECT a.attnum, a.attname FROM pg_attribute a'
+            ' JOIN pg_class t ON a.attrelid = t.oid'
+            ' WHERE t.relname = %s AND a.attnum > 0', [table_name])
+        attnames = dict(cursor.fetchall())
+
+        cursor.execute('SELECT i.indexrelid, CAST(i.indkey AS text) FROM pg_index i'
+            ' JOIN pg_class t ON i.indrelid = t.oid'
+            ' WHERE t.relname = %s', [table_name])
+        for name, indkey in cursor.fetchall():
+            indexes[name] = [(seqno, attnames.get(int(attnum)))
+                for seqno, attnum in enumerate(indkey.split())]
+    elif vendor == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % qn(table_name))
+        for row in cursor.fetchall():
+            indexes.setdefault(row[2], []).append((row[3], row[4]))
+    else:
+        return None
+
+    return [tuple(column for seqno, column in sorted(columns))
+        for columns in indexes.values()]
+
+
+def index_sql(model, columns):
+    """
+    Returns the ``CREATE INDEX`` statement for the passed columns.
+    """
+
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    name = truncate_name('%s_%s' % (table, '_'.join(columns)),
+        connection.ops.max_name_length())
+
+    return 'CREATE INDEX %s ON %s (%s)' % (
+        qn(name), qn(table), ', '.join(qn(column) for column in columns))
+
+
+def missing_indexes(model, cursor=None):
+    """
+    Returns ``CREATE INDEX`` statements for all recommended indexes which do
+    not exist yet. Existing indexes starting with the recommended columns are
+    good enough.
+    """
+
+    columns = recommended_index_columns(model)
+    if not columns:
+        return []
+
+    cursor = cursor or connection.cursor()
+    existing = get_indexes(cursor, model._meta.db_table)
+    if existing is None:
+        return []
+
+    return [index_sql(model, index) for index in columns
+        if not any(e[:len(index)] == index for e in existing)]
+
+
+def create_recommended_indexes(sender, created_models, **kwargs):
+    """
+    ``post_syncdb`` handler creating the recommended indexes for all newly
+    created tables.
+    """
+
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names()
+
+    for model in created_models:
+        # Content types may be created at runtime, after syncdb
+        if model._meta.db_table not in tables:
+            continue
+
+        for sql in missing_indexes(model, cursor):
+            if kwargs.get('verbosity', 1) >= 2:
+                print 'Creating recommended index: %s' % sql
+            cursor.execute(sql)
+    transaction.commit_unless_managed()
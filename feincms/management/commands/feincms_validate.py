@@ -12,6 +12,8 @@ from django.core.management.base import NoArgsCommand
 from django.core.management.color import color_style
 from django.db.models import loading
 
+from feincms.management.checker import missing_indexes
+
 
 class Command(NoArgsCommand):
     help = "Check models for common pitfalls."
@@ -31,6 +33,9 @@ class Command(NoArgsCommand):
             if hasattr(model, '_feincms_content_models'):
                 self.validate_content_type(model)
 
+            if hasattr(model, 'feincms_indexes'):
+                self.validate_indexes(model)
+
     def validate_base_model(self, model):
         """
         Validate a subclass of ``feincms.models.Base`` or anything else created
@@ -47,4 +52,12 @@ class Command(NoArgsCommand):
 
         for base in model.__bases__:
             if not base._meta.abstract:
-                print self.style.NOTICE('One of %s bases, %s, is not abstract' % (model, base))
\ No newline at end of file
+                print self.style.NOTICE('One of %s bases, %s, is not abstract' % (model, base))
+
+    def validate_indexes(self, model):
+        """
+        Check whether the indexes recommended for FeinCMS models exist
+        """
+
+        for sql in missing_indexes(model):
+            print self.style.NOTICE('%s is missing a recommended index: %s;' % (model, sql))
@@ -0,0 +1,47 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``rebuild_content_blocks``
+--------------------------
+
+``rebuild_content_blocks`` copies all content blocks into the single table
+maintained by the ``content_blocks`` extension. Run it after activating the
+extension.
+"""
+
+from django.core.management.base import NoArgsCommand
+from django.db.models import loading
+
+from feincms.module.extensions.content_blocks import _block_values
+from feincms.utils import bulk_create
+
+
+class Command(NoArgsCommand):
+    help = "Copy all content blocks into the single table of the content_blocks extension."
+
+    chunk_size = 1000
+
+    def handle_noargs(self, **options):
+        for model in loading.get_models():
+            if hasattr(model, '_feincms_content_block_model'):
+                self.rebuild(model)
+
+    def rebuild(self, model):
+        print "Rebuilding content blocks of %s" % model.__name__
+
+        block_model = model._feincms_content_block_model
+        block_model.objects.all().delete()
+
+        for cls in model._feincms_content_types:
+            queryset = cls.objects.order_by('pk')
+            last = 0
+
+            while True:
+                contents = list(queryset.filter(pk__gt=last)[:self.chunk_size])
+                if not contents:
+                    break
+
+                bulk_create(block_model, [block_model(**_block_values(content))
+                    for content in contents])
+                last = contents[-1].pk
@@ -0,0 +1,61 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``update_ct_inventories``
+-------------------------
+
+``update_ct_inventories`` computes the content type inventories of the
+``ct_tracker`` extension for all objects which do not have one yet. Run it
+after deploying, so that visitors do not have to compute (and save) them.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import Q, loading
+
+from feincms.module.extensions.ct_tracker import TrackerContentProxy,\
+    update_inventory
+
+
+class Command(NoArgsCommand):
+    help = "Compute missing content type inventories of the ct_tracker extension."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Recompute all inventories, not only missing ones.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+            help='Number of objects updated per transaction.'),
+        )
+
+    def handle_noargs(self, **options):
+        for model in loading.get_models():
+            if issubclass(getattr(model, 'content_proxy_class', object), TrackerContentProxy):
+                self.update(model, options['all'], options['chunk_size'])
+
+    def update(self, model, all, chunk_size):
+        queryset = model._default_manager.order_by('pk')
+        if not all:
+            queryset = queryset.filter(Q(_ct_inventory__isnull=True) | Q(_ct_inventory=''))
+
+        print "Updating content type inventories of %s" % model.__name__
+
+        last = 0
+        count = 0
+        while True:
+            items = list(queryset.filter(pk__gt=last)[:chunk_size])
+            if not items:
+                break
+
+            self.update_chunk(items)
+            last = items[-1].pk
+            count += len(items)
+
+        print "%d inventories updated" % count
+
+    @transaction.commit_on_success
+    def update_chunk(self, items):
+        for item in items:
+            update_inventory(item)
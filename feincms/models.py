@@ -5,13 +5,20 @@ All models defined here are abstract, which means no tables are created in
 the feincms\_ namespace.
 """
 
+from __future__ import with_statement
+
 import operator
 import warnings
 
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
+
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
 from django.db import connection, models
-from django.db.models import Q
+from django.db.models import Q, signals
 from django.db.models.fields import FieldDoesNotExist
 from django.db.models.loading import get_model
 from django.forms.widgets import Media
@@ -21,7 +28,12 @@ from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
 from feincms import ensure_completely_loaded
-from feincms.utils import get_object, copy_model_instance
+from feincms.management.checker import create_recommended_indexes
+from feincms.signals import content_copied
+from feincms.utils import bulk_create, get_object, copy_model_instance
+from feincms.utils.cache import invalidate_rendered_content
+from feincms.utils.instrumentation import measure
+from feincms.utils.queryset_transform import TransformManager, TransformQuerySet
 
 
 class Region(object):
@@ -78,6 +90,61 @@ class Template(object):
         return force_unicode(self.title)
 
 
+_bulk_content_saves = local()
+
+class bulk_content_save(object):
+    """
+    Context manager marking the content blocks of ``item`` as being saved in
+    bulk, f.e. by the item editor or ``copy_content_from``. Extensions
+    maintaining data derived from the content blocks (f.e. ``ct_tracker``)
+    skip the work per content block and update ``item`` once afterwards, when
+    ``itemeditor_post_save_related`` or ``content_copied`` is sent.
+
+    The code saving the content blocks adds the keys of all regions it
+    touched to ``regions``; they can be retrieved afterwards using
+    ``pop_saved_regions``.
+    """
+
+    def __init__(self, item):
+        self.item = item
+        self.key = (item._meta.db_table, item.pk)
+        self.regions = set()
+
+    def __enter__(self):
+        if not hasattr(_bulk_content_saves, 'keys'):
+            _bulk_content_saves.keys = {}
+        keys = _bulk_content_saves.keys
+        keys[self.key] = keys.get(self.key, 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        keys = _bulk_content_saves.keys
+        keys[self.key] -= 1
+        if not keys[self.key]:
+            del keys[self.key]
+
+        self.regions.discard(None)
+        self.item._feincms_saved_regions = self.regions | getattr(
+            self.item, '_feincms_saved_regions', set())
+        return False
+
+def in_bulk_content_save(cls, pk):
+    """
+    Returns whether the content blocks of the object of type ``cls`` with
+    primary key ``pk`` are being saved inside ``bulk_content_save``.
+    """
+
+    return (cls._meta.db_table, pk) in getattr(_bulk_content_saves, 'keys', ())
+
+def pop_saved_regions(item):
+    """
+    Returns the keys of all regions touched by ``bulk_content_save`` blocks
+    for ``item`` since the last call.
+    """
+
+    return item.__dict__.pop('_feincms_saved_regions', set())
+
+
 class ContentProxy(object):
     """
     The ``ContentProxy`` is responsible for loading the content blocks for all
@@ -86,14 +153,23 @@ class ContentProxy(object):
 
     The content inside a region can be fetched using attribute access with
     the region key. This is achieved through a custom ``__getattr__``
-    implementation.
+    implementation. The content blocks of all regions are loaded when the
+    first region is accessed, using one query per content type in use. Set
+    ``lazy_regions = True`` on a subclass to load content blocks region by
+    region instead, so that only the regions which are actually accessed are
+    loaded from the database (at the cost of one query per region and
+    content type when all regions are rendered).
     """
 
+    lazy_regions = False
+
     def __init__(self, item):
         item._needs_content_types()
         self.item = item
         self._cache = {
             'cts': {},
+            'instances': {},
+            'regions': {},
             }
 
     def _inherit_from(self):
@@ -107,6 +183,30 @@ class ContentProxy(object):
 
         return self.item.get_ancestors(ascending=True).values_list('pk', flat=True)
 
+    def _content_types_for_template(self, regions=None):
+        """
+        Returns a list of ``(ct_idx, content type)`` tuples for all content
+        types which may be added to the passed regions of the current template
+        (defaults to all regions of the template). Tables of other content
+        types cannot contain content for this object and need not be queried.
+
+        The result is cached per model, template and regions.
+        """
+
+        template = self.item.template
+        index = self.item._feincms_template_content_types
+        key = (template.key, regions and tuple(sorted(regions)))
+
+        if key not in index:
+            allowed = set()
+            for region in template.regions:
+                if regions is None or region.key in regions:
+                    allowed.update(region._content_types)
+
+            index[key] = [(idx, cls) for idx, cls
+                in enumerate(self.item._feincms_content_types) if cls in allowed]
+        return index[key]
+
     def _fetch_content_type_counts(self):
         """
         Returns a structure describing which content types exist for the object
@@ -125,41 +225,78 @@ class ContentProxy(object):
         """
 
         if 'counts' not in self._cache:
-            counts = self._fetch_content_type_count_helper(self.item.pk)
-
-            empty_inherited_regions = set()
-            for region in self.item.template.regions:
-                if region.inherited and not counts.get(region.key):
-                    empty_inherited_regions.add(region.key)
-
-            if empty_inherited_regions:
-                for parent in self._inherit_from():
-                    parent_counts = self._fetch_content_type_count_helper(
-                        parent, regions=tuple(empty_inherited_regions))
+            with measure(self.item.__class__, 'counts', instance=self.item):
+                counts = self._fetch_content_type_count_helper(self.item.pk)
 
-                    counts.update(parent_counts)
-                    for key in parent_counts.keys():
-                        empty_inherited_regions.discard(key)
+                empty_inherited_regions = set()
+                for region in self.item.template.regions:
+                    if region.inherited and not counts.get(region.key):
+                        empty_inherited_regions.add(region.key)
 
-                    if not empty_inherited_regions:
-                        break
+                if empty_inherited_regions:
+                    counts.update(self._fetch_inherited_content_type_counts(
+                        tuple(empty_inherited_regions)))
 
             self._cache['counts'] = counts
         return self._cache['counts']
 
+    def _fetch_inherited_content_type_counts(self, regions):
+        """
+        Returns the same structure as ``_fetch_content_type_counts`` for the
+        passed regions, using the content of the nearest object returned by
+        ``_inherit_from`` having content in the respective region.
+
+        All candidates are inspected using a single query.
+        """
+
+        ancestors = list(self._inherit_from())
+        types = self._content_types_for_template(regions)
+        if not ancestors or not types:
+            return {}
+
+        tmpl = u' '.join([
+            'SELECT %d AS ct_idx, parent_id, region, COUNT(id) FROM %s',
+            'WHERE parent_id IN (' + ','.join(['%%s'] * len(ancestors)) + ')',
+            'AND region IN (' + ','.join(['%%s'] * len(regions)) + ')',
+            'GROUP BY parent_id, region',
+            ])
+        args = (list(ancestors) + list(regions)) * len(types)
+
+        sql = ' UNION '.join([tmpl % (idx, cls._meta.db_table)\
+            for idx, cls in types])
+
+        cursor = connection.cursor()
+        cursor.execute(sql, args)
+
+        found = {}
+        for ct_idx, parent, region, count in cursor.fetchall():
+            if count:
+                found.setdefault(region, {}).setdefault(parent, []).append(ct_idx)
+
+        _c = {}
+        for region, parents in found.items():
+            pk = min(parents.keys(), key=ancestors.index)
+            _c[region] = [(pk, ct_idx) for ct_idx in sorted(parents[pk])]
+
+        return _c
+
     def _fetch_content_type_count_helper(self, pk, regions=None):
+        types = self._content_types_for_template(regions)
+        if not types:
+            return {}
+
         tmpl = ['SELECT %d AS ct_idx, region, COUNT(id) FROM %s WHERE parent_id=%s']
         args = []
 
         if regions:
             tmpl.append('AND region IN (' + ','.join(['%%s'] * len(regions)) + ')')
-            args.extend(regions * len(self.item._feincms_content_types))
+            args.extend(list(regions) * len(types))
 
         tmpl.append('GROUP BY region')
         tmpl = u' '.join(tmpl)
 
         sql = ' UNION '.join([tmpl % (idx, cls._meta.db_table, pk)\
-            for idx, cls in enumerate(self.item._feincms_content_types)])
+            for idx, cls in types])
         sql = 'SELECT * FROM ( ' + sql + ' ) AS ct ORDER BY ct_idx'
 
         cursor = connection.cursor()
@@ -189,25 +326,61 @@ class ContentProxy(object):
             counts = counts_by_type.get(type)
             if type not in self._cache['cts']:
                 if counts:
-                    self._cache['cts'][type] = list(type.get_queryset(
-                        reduce(operator.or_, (Q(region=r[0], parent=r[1]) for r in counts))))
+                    with measure(type, 'load', instance=self.item):
+                        self._cache['cts'][type] = self._register_instances(type.get_queryset(
+                            reduce(operator.or_, (Q(region=r[0], parent=r[1]) for r in counts))))
                 else:
                     self._cache['cts'][type] = []
 
-    def _fetch_regions(self):
+    def _register_instances(self, instances):
         """
+        Content blocks may be loaded more than once, f.e. first by region and
+        then by type. Always hand out the same instance for the same content
+        block, because content types may store state on the instance while
+        processing the request (see ``ApplicationContent``).
         """
 
-        if 'regions' not in self._cache:
-            self._popuplate_content_type_caches(self.item._feincms_content_types)
-            contents = {}
-            for type, content_list in self._cache['cts'].items():
-                for instance in content_list:
-                    contents.setdefault(instance.region, []).append(instance)
+        registry = self._cache['instances']
+        return [registry.setdefault((instance.__class__, instance.pk), instance)
+            for instance in instances]
+
+    def _fetch_region(self, region):
+        """
+        Returns the content blocks of a single region (or of the ancestor it
+        inherits from). Loads the content blocks of all regions unless
+        ``lazy_regions`` is set.
+        """
+
+        if region not in self._cache['regions']:
+            if not self.lazy_regions:
+                self._popuplate_content_type_caches(self.item._feincms_content_types)
+
+            pks_by_type = {}
+            for pk, ct_idx in self._fetch_content_type_counts().get(region, []):
+                pks_by_type.setdefault(self.item._feincms_content_types[ct_idx], []).append(pk)
+
+            contents = []
+            for type, pks in pks_by_type.items():
+                if type in self._cache['cts']:
+                    contents.extend(content for content in self._cache['cts'][type]
+                        if content.region == region and content.parent_id in pks)
+                else:
+                    with measure(type, 'load', instance=self.item):
+                        contents.extend(self._register_instances(type.get_queryset(
+                            Q(region=region, parent__in=pks))))
+
+            self._cache['regions'][region] = sorted(contents, key=lambda c: c.ordering)
+        return self._cache['regions'][region]
 
-            self._cache['regions'] = dict((region, sorted(instances, key=lambda c: c.ordering))\
-                for region, instances in contents.iteritems())
-        return self._cache['regions']
+    def _fetch_regions(self):
+        """
+        Returns the content blocks of all regions. Loads all content types
+        in one go instead of region by region.
+        """
+
+        self._popuplate_content_type_caches(self.item._feincms_content_types)
+        return dict((region, self._fetch_region(region))
+            for region in self._fetch_content_type_counts())
 
     def all_of_type(self, type_or_tuple):
         """
@@ -256,11 +429,174 @@ class ContentProxy(object):
         if (attr.startswith('__')):
             raise AttributeError
 
+        # Already loaded, f.e. by ``prefetch_content``
+        if attr in self._cache['regions']:
+            return self._cache['regions'][attr]
+
         # Do not trigger loading of real content type models if not necessary
         if not self._fetch_content_type_counts().get(attr):
             return []
 
-        return self._fetch_regions().get(attr, [])
+        return self._fetch_region(attr)
+
+
+class EagerContentProxy(ContentProxy):
+    """
+    A ``ContentProxy`` which does not determine the content types in use
+    before loading content blocks. Instead, all content types are loaded
+    straight away using one query per content type. Content blocks of
+    ancestors for inherited regions are loaded by the same queries.
+
+    This trades the count query (and the additional count queries for empty
+    inherited regions) for potentially useless queries on content type tables
+    which do not contain any content for the current object. This is a good
+    deal if round trips to the database are expensive and few content types
+    are registered. Use it as follows::
+
+        Page.content_proxy_class = EagerContentProxy
+    """
+
+    def _fetch_content_type_counts(self):
+        if 'counts' not in self._cache:
+            self._fetch_content()
+        return self._cache['counts']
+
+    def _fetch_content(self):
+        inherited = [region.key for region in self.item.template.regions if region.inherited]
+
+        filter_args = Q(parent=self.item.pk)
+        if inherited:
+            # Ancestors are determined using a subquery if _inherit_from
+            # returns a queryset
+            filter_args |= Q(parent__in=self._inherit_from(), region__in=inherited)
+
+        contents = {}
+        for idx, instance in self._fetch_instances(filter_args):
+            contents.setdefault(instance.region, {}).setdefault(
+                instance.parent_id, []).append((idx, instance))
+
+        ancestors = None
+        counts = {}
+        used = []
+        for region, by_parent in contents.items():
+            if self.item.pk in by_parent:
+                pk = self.item.pk
+            elif len(by_parent) == 1:
+                pk = by_parent.keys()[0]
+            else:
+                # Several ancestors have content in this region; inherit from
+                # the first one in _inherit_from order
+                if ancestors is None:
+                    ancestors = list(self._inherit_from())
+                pk = min(by_parent.keys(), key=ancestors.index)
+
+            for idx, instance in sorted(by_parent[pk], key=lambda row: row[0]):
+                if (pk, idx) not in counts.setdefault(region, []):
+                    counts[region].append((pk, idx))
+                used.append((idx, instance))
+
+        for idx, type in enumerate(self.item._feincms_content_types):
+            self._cache['cts'][type] = [instance for i, instance in used if i == idx]
+        self._cache['counts'] = counts
+
+    def _fetch_instances(self, filter_args):
+        """
+        Yields ``(ct_idx, instance)`` tuples for all content blocks matching
+        ``filter_args``
+        """
+
+        for idx, type in self._content_types_for_template():
+            with measure(type, 'load', instance=self.item):
+                instances = list(type.get_queryset(filter_args))
+
+            for instance in instances:
+                yield idx, instance
+
+
+def prefetch_content(items, regions=None):
+    """
+    Load the content blocks of all passed CMS objects at once and attach them
+    to the objects' content proxies. Runs one query per content type, regardless
+    of the number of objects passed.
+
+    If ``regions`` is given, only content blocks from these regions are loaded.
+    Empty inherited regions are not prefetched; the content proxy falls back
+    to the ancestor lookup when such a region is accessed.
+
+    All objects must be instances of the same CMS base model. This is mostly
+    used through ``ContentQuerySet.prefetch_content``::
+
+        Page.objects.filter(parent=page).prefetch_content(regions=('main',))
+    """
+
+    proxies = {}
+    for item in items:
+        # Do not use item.pk here, the content proxy might load its content
+        # from another object (f.e. symlinked pages)
+        proxy = item.content
+        proxies.setdefault(proxy.item.pk, []).append(proxy)
+
+    if not proxies:
+        return
+
+    filter_args = Q(parent__in=proxies.keys())
+    if regions:
+        filter_args &= Q(region__in=regions)
+
+    # Only query content types allowed by the templates of the passed objects
+    types = set()
+    for proxy_list in proxies.values():
+        for proxy in proxy_list:
+            types.update(proxy._content_types_for_template(regions))
+
+    contents = {}
+    for idx, type in sorted(types):
+        with measure(type, 'load'):
+            instances = list(type.get_queryset(filter_args))
+
+        for instance in instances:
+            contents.setdefault((instance.parent_id, instance.region), []).append(instance)
+
+    for pk, proxy_list in proxies.items():
+        for proxy in proxy_list:
+            for region in proxy.item.template.regions:
+                if regions and region.key not in regions:
+                    continue
+
+                instances = contents.get((pk, region.key))
+                if instances:
+                    proxy._cache['regions'][region.key] = sorted(
+                        proxy._register_instances(instances), key=lambda c: c.ordering)
+                elif not region.inherited:
+                    proxy._cache['regions'][region.key] = []
+
+
+class ContentQuerySet(TransformQuerySet):
+    """
+    Queryset for CMS base models which is able to load the content blocks of
+    all returned objects in bulk.
+    """
+
+    def prefetch_content(self, regions=None):
+        """
+        Load content blocks (optionally only for the passed region keys) for
+        all objects as soon as the queryset is evaluated. See
+        ``prefetch_content`` for details.
+        """
+
+        return self.transform(lambda items: prefetch_content(items, regions=regions))
+
+
+class ContentManager(TransformManager):
+    """
+    Default manager for CMS base models, returns ``ContentQuerySet`` instances.
+    """
+
+    def get_query_set(self):
+        return ContentQuerySet(self.model, using=self._db)
+
+    def prefetch_content(self, regions=None):
+        return self.get_query_set().prefetch_content(regions=regions)
 
 
 class ExtensionsMixin(object):
@@ -437,11 +773,27 @@ def create_base_model(inherit_from=models.Model):
                 for template in cls._feincms_templates.values()]
             field.default = field.choices[0][0]
 
+            # Templates might have been replaced
+            cls._feincms_template_content_types = {}
+
+            # Content types created before this call should be allowed in the
+            # regions of the newly registered templates too
+            existing = {}
+            for region in getattr(cls, '_feincms_all_regions', ()):
+                for type in region._content_types:
+                    if type not in existing.setdefault(region.key, []):
+                        existing[region.key].append(type)
+
             # Build a set of all regions used anywhere
             cls._feincms_all_regions = set()
             for template in cls._feincms_templates.values():
                 cls._feincms_all_regions.update(template.regions)
 
+            for region in cls._feincms_all_regions:
+                if not region._content_types and region.key in existing:
+                    region._content_types.extend(sorted(existing[region.key],
+                        key=cls._feincms_content_types.index))
+
         #: ``ContentProxy`` class this object uses to collect content blocks
         content_proxy_class = ContentProxy
 
@@ -545,6 +897,9 @@ def create_base_model(inherit_from=models.Model):
                 'fe_render': fe_render,
                 'fe_identifier': fe_identifier,
                 'get_queryset': classmethod(get_queryset),
+                # Content blocks are always fetched by parent and region and
+                # sorted by ordering (see feincms.management.checker)
+                'feincms_indexes': [('parent', 'region', 'ordering')],
                 'Meta': Meta,
                 'parent': models.ForeignKey(cls, related_name='%(class)s_set'),
                 'region': models.CharField(max_length=255),
@@ -695,6 +1050,10 @@ def create_base_model(inherit_from=models.Model):
                 if region.key in regions:
                     region._content_types.append(new_type)
 
+            # Index of allowed content types per template, filled by the
+            # ContentProxy when needed
+            cls._feincms_template_content_types = {}
+
             # Add a list of CMS base types for which a concrete content type has
             # been created to the abstract content type. This is needed f.e. for the
             # update_rsscontent management command, which needs to find all concrete
@@ -778,13 +1137,42 @@ def create_base_model(inherit_from=models.Model):
             Copy all content blocks over to another CMS base object. (Must be of the
             same type, but this is not enforced. It will crash if you try to copy content
             from another CMS base type.)
+
+            The content blocks of each content type are inserted using bulk
+            inserts (batched on SQLite), which neither calls ``save()`` nor sends the ``pre_save``
+            and ``post_save`` signals. Content types overriding ``save()`` are
+            copied one by one instead. Content types can choose either way
+            explicitly by setting ``feincms_copy_with_save`` to ``True`` or
+            ``False``. The ``content_copied`` signal is sent afterwards.
             """
 
-            for cls in self._feincms_content_types:
-                for content in cls.objects.filter(parent=obj):
-                    new = copy_model_instance(content, exclude=('id', 'parent'))
-                    new.parent = self
-                    new.save()
+            with bulk_content_save(self) as bulk:
+                for cls in self._feincms_content_types:
+                    copies = []
+                    for content in cls.objects.filter(parent=obj):
+                        new = copy_model_instance(content, exclude=('id', 'parent'))
+                        new.parent = self
+                        copies.append(new)
+
+                    if not copies:
+                        continue
+
+                    bulk.regions.update(new.region for new in copies)
+
+                    with_save = getattr(cls, 'feincms_copy_with_save', None)
+                    if with_save is None:
+                        with_save = cls.save.im_func is not models.Model.save.im_func
+
+                    if with_save:
+                        for new in copies:
+                            new.save()
+                    else:
+                        bulk_create(cls, copies)
+
+            if hasattr(self, '_content_proxy'):
+                del self._content_proxy
+
+            content_copied.send(sender=self.__class__, instance=self, source=obj)
 
         def replace_content_with(self, obj):
             """
@@ -793,8 +1181,11 @@ def create_base_model(inherit_from=models.Model):
             Deletes all content blocks and calls ``copy_content_from`` afterwards.
             """
 
-            for cls in self._feincms_content_types:
-                cls.objects.filter(parent=self).delete()
+            with bulk_content_save(self) as bulk:
+                for cls in self._feincms_content_types:
+                    queryset = cls.objects.filter(parent=self)
+                    bulk.regions.update(queryset.values_list('region', flat=True))
+                    queryset.delete()
             self.copy_content_from(obj)
 
         @classmethod
@@ -815,3 +1206,14 @@ def create_base_model(inherit_from=models.Model):
 
 # Legacy support
 Base = create_base_model()
+
+# Create recommended indexes on new tables (see feincms.management.checker)
+signals.post_syncdb.connect(create_recommended_indexes,
+    dispatch_uid='feincms.create_recommended_indexes')
+
+# Drop cached output of content blocks when they are changed (see
+# feincms.utils.cache)
+signals.post_save.connect(invalidate_rendered_content,
+    dispatch_uid='feincms.render_cache.post_save')
+signals.post_delete.connect(invalidate_rendered_content,
+    dispatch_uid='feincms.render_cache.post_delete')
@@ -12,10 +12,10 @@ from django.utils.translation import ugettext_lazy as _
 
 from feincms.admin import item_editor
 from feincms.management.checker import check_database_schema
-from feincms.models import Base
+from feincms.models import Base, ContentManager
 
 
-class EntryManager(models.Manager):
+class EntryManager(ContentManager):
     def published(self):
         return self.filter(
             published=True,
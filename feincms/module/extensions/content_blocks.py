@@ -0,0 +1,225 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Store a copy of all content blocks of a CMS base model in a single table.
+Every row holds the parent, region, ordering, the content type and the field
+values of one content block. The content proxy loads the content of an
+object (including inherited regions) using a single query on this table,
+regardless of the number of registered content types.
+
+The tables of the concrete content types stay the primary storage; the item
+editor, relations and all existing code continue to work with them. The
+single table is kept in sync when content blocks are saved, deleted or
+copied. Run ``./manage.py rebuild_content_blocks`` after activating the
+extension to copy existing content blocks into the single table.
+
+Content blocks are rebuilt from their field values without running any
+queries; related objects (f.e. the media file of a ``MediaFileContent``) are
+loaded lazily when accessed.
+
+The extension uses the ``EagerContentProxy`` unless the ``ct_tracker``
+extension has been registered before, in which case the content blocks
+listed in the inventory are loaded from the single table. Register
+extensions wrapping the content proxy (f.e. ``content_cache``) afterwards.
+"""
+
+from __future__ import with_statement
+
+import operator
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.utils.translation import ugettext_lazy as _
+
+from feincms.contrib.fields import JSONField
+from feincms.models import ContentProxy, EagerContentProxy
+from feincms.signals import content_copied
+from feincms.utils import bulk_create
+from feincms.utils.instrumentation import measure
+
+
+# ------------------------------------------------------------------------
+def create_content_block_model(cls):
+    """
+    Creates the model holding the content blocks of the passed CMS base
+    model. The table is named after the base model's table, f.e.
+    ``page_page_content_blocks``.
+    """
+
+    class Meta:
+        app_label = cls._meta.app_label
+        db_table = '%s_content_blocks' % cls._meta.db_table
+        ordering = ['ordering']
+        verbose_name = _('content block')
+        verbose_name_plural = _('content blocks')
+
+    attrs = {
+        '__module__': cls.__module__,
+        'Meta': Meta,
+        'parent': models.ForeignKey(cls, related_name='+'),
+        'region': models.CharField(max_length=255),
+        'ordering': models.IntegerField(_('ordering'), default=0),
+        'content_type': models.CharField(max_length=255),
+        'content_id': models.IntegerField(),
+        'data': JSONField(blank=True),
+        'feincms_indexes': [
+            ('parent', 'region', 'ordering'),
+            ('content_type', 'content_id'),
+            ],
+        }
+
+    return type('%sContentBlock' % cls.__name__, (models.Model,), attrs)
+
+# ------------------------------------------------------------------------
+def _block_values(content):
+    return {
+        'parent_id': content.parent_id,
+        'region': content.region,
+        'ordering': content.ordering,
+        'content_type': content._meta.db_table,
+        'content_id': content.pk,
+        'data': dict((f.attname, f.get_prep_value(getattr(content, f.attname)))
+            for f in content._meta.fields),
+        }
+
+def _content_from_block(type, block):
+    content = type(**dict((f.attname, f.to_python(block.data[f.attname]))
+        for f in type._meta.fields if f.attname in block.data))
+    content._state.adding = False
+    content._state.db = type.objects.db
+    return content
+
+def update_content_block(content):
+    """
+    Write the current state of the passed content block into the single table.
+    """
+
+    model = content._feincms_content_class._feincms_content_block_model
+    values = _block_values(content)
+
+    update = dict(values, parent=values['parent_id'])
+    del update['parent_id']
+
+    if not model.objects.filter(content_type=values['content_type'],
+            content_id=values['content_id']).update(**update):
+        model.objects.create(**values)
+
+def rebuild_content_blocks(item):
+    """
+    Replace the content blocks of the passed object in the single table with
+    the current content blocks of all content types.
+    """
+
+    model = item._feincms_content_block_model
+    model.objects.filter(parent=item.pk).delete()
+    bulk_create(model, [model(**_block_values(content))
+        for cls in item._feincms_content_types
+        for content in cls.objects.filter(parent=item.pk)])
+
+# ------------------------------------------------------------------------
+class ContentBlockProxyMixin(object):
+    """
+    Mixin for ``EagerContentProxy`` and ``TrackerContentProxy`` classes which
+    loads the content blocks from the single table instead of querying the
+    tables of all content types.
+    """
+
+    def _contents_from_blocks(self, blocks, types):
+        for block in blocks:
+            if block.content_type not in types:
+                # Content type has been removed or is not allowed in this
+                # template
+                continue
+
+            idx, type = types[block.content_type]
+            content = _content_from_block(type, block)
+            if content.parent_id == self.item.pk:
+                content.parent = self.item
+            yield idx, content
+
+    def _fetch_instances(self, filter_args):
+        types = dict((cls._meta.db_table, (idx, cls))
+            for idx, cls in self._content_types_for_template())
+
+        model = self.item._feincms_content_block_model
+        with measure(model, 'load', instance=self.item):
+            blocks = list(model.objects.filter(filter_args))
+
+        return self._contents_from_blocks(blocks, types)
+
+    def _fetch_instances_by_pk(self, pks_by_type):
+        registry = self._cache['instances']
+        types = {}
+        filters = []
+        for ct_idx, pks in pks_by_type.items():
+            type = self.item._feincms_content_types[ct_idx]
+            missing = [pk for pk in pks if (type, pk) not in registry]
+            if missing:
+                types[type._meta.db_table] = (ct_idx, type)
+                filters.append(Q(content_type=type._meta.db_table,
+                    content_id__in=missing))
+
+        if filters:
+            model = self.item._feincms_content_block_model
+            with measure(model, 'load', instance=self.item):
+                blocks = list(model.objects.filter(reduce(operator.or_, filters)))
+
+            self._register_instances(content for idx, content
+                in self._contents_from_blocks(blocks, types))
+        return registry
+
+
+class ContentBlockProxy(ContentBlockProxyMixin, EagerContentProxy):
+    pass
+
+# ------------------------------------------------------------------------
+def _content_block_model(sender):
+    cls = getattr(sender, '_feincms_content_class', None)
+    return getattr(cls, '_feincms_content_block_model', None)
+
+def content_post_save_handler(sender, instance, raw=False, **kwargs):
+    if _content_block_model(sender) is not None and not raw:
+        update_content_block(instance)
+
+def content_post_delete_handler(sender, instance, **kwargs):
+    model = _content_block_model(sender)
+    if model is not None:
+        model.objects.filter(content_type=instance._meta.db_table,
+            content_id=instance.pk).delete()
+
+def content_copied_handler(sender, instance, **kwargs):
+    if hasattr(sender, '_feincms_content_block_model'):
+        rebuild_content_blocks(instance)
+
+post_save.connect(content_post_save_handler,
+    dispatch_uid='feincms.content_blocks.post_save')
+post_delete.connect(content_post_delete_handler,
+    dispatch_uid='feincms.content_blocks.post_delete')
+content_copied.connect(content_copied_handler,
+    dispatch_uid='feincms.content_blocks.content_copied')
+
+# ------------------------------------------------------------------------
+def register(cls, admin_cls):
+    from feincms.module.extensions.ct_tracker import TrackerContentProxy
+
+    proxy = cls.content_proxy_class
+    if proxy is ContentProxy:
+        cls.content_proxy_class = ContentBlockProxy
+    elif issubclass(proxy, (EagerContentProxy, TrackerContentProxy)):
+        if not issubclass(proxy, ContentBlockProxyMixin):
+            cls.content_proxy_class = type(
+                'ContentBlock%s' % proxy.__name__,
+                (ContentBlockProxyMixin, proxy),
+                {})
+    else:
+        raise ImproperlyConfigured('The content_blocks extension cannot be'
+            ' combined with %s. Register it before extensions wrapping the'
+            ' content proxy (f.e. content_cache).' % proxy.__name__)
+
+    cls._feincms_content_block_model = create_content_block_model(cls)
+
+# ------------------------------------------------------------------------
@@ -0,0 +1,172 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Cache the content blocks of CMS objects across requests. The field data of
+all content blocks (including the content blocks of inherited regions) is
+stored in Django's cache using the object's ``cache_key()``. The cache is
+invalidated automatically when content blocks are saved or deleted and when
+the CMS object itself is saved. The cached content of descendants is only
+invalidated if the object has been moved or content of inherited regions has
+been changed.
+
+The extension wraps the current ``content_proxy_class``, therefore it should
+be registered after the ``ct_tracker`` extension if you use both.
+"""
+
+from django.conf import settings as django_settings
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_delete, post_save
+
+from feincms.signals import content_copied
+from feincms.utils import path_to_cache_key, tree_position_changed
+
+
+# ------------------------------------------------------------------------
+def content_cache_key(item):
+    """
+    Returns the cache key used for the content blocks of the passed object.
+    """
+
+    if hasattr(item, 'cache_key'):
+        key = item.cache_key()
+    else:
+        key = u'%s-%s' % (item._meta.db_table, item.pk)
+    # The content does not depend on the site, and invalidation deletes the
+    # keys of the site saving the object only
+    return path_to_cache_key(key, prefix='CONTENT',
+        site_id=django_settings.SITE_ID)
+
+# ------------------------------------------------------------------------
+class CachedContentProxyMixin(object):
+    """
+    Mixin for ``ContentProxy`` classes which loads the content of all regions
+    from the cache if possible.
+    """
+
+    def _fetch_content_type_counts(self):
+        if 'counts' not in self._cache:
+            ck = content_cache_key(self.item)
+            data = django_cache.get(ck)
+
+            if data is None or not self._from_cache_data(data):
+                super(CachedContentProxyMixin, self)._fetch_content_type_counts()
+                django_cache.set(ck, self._to_cache_data(self._fetch_regions()))
+        return self._cache['counts']
+
+    def _to_cache_data(self, regions):
+        """
+        Content types are created dynamically and cannot be pickled, therefore
+        only their field values are stored.
+        """
+
+        return dict((region, [
+            (content._meta.db_table, dict((f.attname, f.get_prep_value(getattr(content, f.attname)))
+                for f in content._meta.fields))
+            for content in contents
+            ]) for region, contents in regions.items())
+
+    def _from_cache_data(self, data):
+        """
+        Populates the internal caches using the data returned by
+        ``_to_cache_data``. Returns ``False`` if the data does not fit
+        together with the current content types.
+        """
+
+        types = dict((type._meta.db_table, (idx, type))
+            for idx, type in enumerate(self.item._feincms_content_types))
+
+        counts = {}
+        regions = {}
+        cts = dict((type, []) for idx, type in types.values())
+
+        for region, rows in data.items():
+            for db_table, values in rows:
+                if db_table not in types:
+                    return False
+
+                idx, type = types[db_table]
+                content = type(**values)
+                content._state.adding = False
+                content._state.db = type.objects.db
+                if content.parent_id == self.item.pk:
+                    content.parent = self.item
+
+                if (content.parent_id, idx) not in counts.setdefault(region, []):
+                    counts[region].append((content.parent_id, idx))
+                regions.setdefault(region, []).append(content)
+                cts[type].append(content)
+
+        self._cache.update({
+            'counts': counts,
+            'cts': cts,
+            'regions': regions,
+            })
+        return True
+
+# ------------------------------------------------------------------------
+def invalidate_content_cache(item, include_descendants=True):
+    """
+    Remove the cached content of the passed object and (optionally) of all
+    its descendants, which might inherit content from it.
+    """
+
+    items = [item]
+    if include_descendants and hasattr(item, 'get_descendants'):
+        items.extend(item.get_descendants())
+
+    django_cache.delete_many([content_cache_key(i) for i in items])
+
+# ------------------------------------------------------------------------
+def _uses_content_cache(cls):
+    return cls is not None and issubclass(
+        getattr(cls, 'content_proxy_class', object), CachedContentProxyMixin)
+
+def item_post_save_handler(sender, instance, created=False, **kwargs):
+    """
+    Moving an object affects the inherited content of all descendants, other
+    changes only affect the object itself.
+    """
+
+    invalidate_content_cache(instance, include_descendants=not created and
+        tree_position_changed(instance))
+
+def content_post_save_handler(sender, instance, **kwargs):
+    cls = getattr(sender, '_feincms_content_class', None)
+    if not _uses_content_cache(cls):
+        return
+
+    try:
+        parent = instance.parent
+    except ObjectDoesNotExist:
+        # The parent is being deleted
+        return
+
+    inherited = any(region.inherited for region in cls._feincms_all_regions
+        if region.key == instance.region)
+    invalidate_content_cache(parent, include_descendants=inherited)
+
+def content_copied_handler(sender, instance, **kwargs):
+    if _uses_content_cache(sender):
+        invalidate_content_cache(instance)
+
+post_save.connect(content_post_save_handler,
+    dispatch_uid='feincms.content_cache.post_save')
+post_delete.connect(content_post_save_handler,
+    dispatch_uid='feincms.content_cache.post_delete')
+content_copied.connect(content_copied_handler,
+    dispatch_uid='feincms.content_cache.content_copied')
+
+# ------------------------------------------------------------------------
+def register(cls, admin_cls):
+    if not issubclass(cls.content_proxy_class, CachedContentProxyMixin):
+        cls.content_proxy_class = type(
+            'Cached%s' % cls.content_proxy_class.__name__,
+            (CachedContentProxyMixin, cls.content_proxy_class),
+            {})
+
+    post_save.connect(item_post_save_handler, sender=cls)
+
+# ------------------------------------------------------------------------
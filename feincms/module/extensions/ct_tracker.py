@@ -14,116 +14,323 @@
 """
 Track the content types for pages. Instead of gathering the content
 types present in each page at run time, save the current state at
-saving time, thus saving at least one DB query on page delivery.
+saving time, thus saving at least one DB query on page delivery. The
+inventory lists the primary keys of all content blocks, therefore content
+blocks are fetched by primary key and need not be sorted.
+
+The inventory is computed as soon as the item editor has saved an object
+including all its content blocks. Objects saved elsewhere get their
+inventory on the first request. Use ``./manage.py update_ct_inventories``
+to compute all missing inventories at once, f.e. after a deployment.
 """
 
+from __future__ import with_statement
+
+from django.conf import settings as django_settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import class_prepared, post_save, pre_save
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.translation import ugettext_lazy as _
 
+from feincms import settings
 from feincms.contrib.fields import JSONField
-from feincms.models import ContentProxy
+from feincms.models import ContentProxy, in_bulk_content_save,\
+    pop_saved_regions
+from feincms.signals import content_copied, itemeditor_post_save_related
+from feincms.utils import path_to_cache_key, tree_position_changed
+from feincms.utils.instrumentation import measure
 
 
-INVENTORY_VERSION = 1
+INVENTORY_VERSION = 2
 _translation_map_cache = {}
 
 
 # ------------------------------------------------------------------------
 class TrackerContentProxy(ContentProxy):
+    """
+    The inventory of an object lists the primary keys of all its content
+    blocks (including content blocks in inherited regions), ordered by region
+    and ordering. The content blocks are fetched using their primary keys and
+    do not need to be sorted anymore:
+
+        {
+            '_version_': 2,
+            'region_key': [
+                [parent_pk, django_ct_id, content_pk],
+                ...
+                ],
+            ...
+        }
+    """
+
     def _fetch_content_type_counts(self):
+        if 'counts' not in self._cache:
+            counts = {}
+            for region, items in self._fetch_plan().items():
+                counts[region] = sorted(set((pk, ct_idx)
+                    for pk, ct_idx, content_pk in items), key=lambda row: row[1])
+            self._cache['counts'] = counts
+        return self._cache['counts']
+
+    def _fetch_plan(self):
         """
+        Returns the inventory of the current object in the same format, but
+        with indices into the item._feincms_content_types list instead of
+        Django's content type IDs.
+
         If an object with an empty _ct_inventory is encountered, compute all the
-        content types currently used on that object and save the list in the
+        content blocks currently used on that object and save the list in the
         object itself. Further requests for that object can then access that
-        information and find out which content types are used without resorting
-        to multiple selects on different ct tables.
+        information without resorting to multiple selects on different ct
+        tables.
 
         It is therefore important that even an "empty" object does not have an
         empty _ct_inventory.
         """
 
-        if 'counts' not in self._cache:
+        if 'plan' not in self._cache:
             if self.item._ct_inventory and \
                     self.item._ct_inventory.get('_version_', -1) == INVENTORY_VERSION:
 
                 try:
-                    self._cache['counts'] = self._from_inventory(self.item._ct_inventory)
+                    self._cache['plan'] = self._from_inventory(self.item._ct_inventory)
                 except KeyError:
                     # It's possible that the inventory does not fit together with the
                     # current models anymore, f.e. because a content type has been
                     # removed.
                     pass
 
-            if 'counts' not in self._cache:
-                super(TrackerContentProxy, self)._fetch_content_type_counts()
+            if 'plan' not in self._cache:
+                with measure(self.item.__class__, 'counts', instance=self.item):
+                    self._cache['plan'] = self._compute_plan()
 
-                self.item._ct_inventory = self._to_inventory(self._cache['counts'])
+                self.item._ct_inventory = self._to_inventory(self._cache['plan'])
                 self.item.__class__.objects.filter(id=self.item.id).update(
                     _ct_inventory=self.item._ct_inventory)
+        return self._cache['plan']
 
-                # Run post save handler by hand
-                if hasattr(self.item, 'get_descendants'):
-                    self.item.get_descendants(include_self=False).update(_ct_inventory=None)
-        return self._cache['counts']
+    def _compute_plan(self):
+        plan = self._fetch_content_pks([self.item.pk])
+
+        empty_inherited_regions = tuple(region.key for region
+            in self.item.template.regions if region.inherited and not plan.get(region.key))
+
+        if empty_inherited_regions:
+            ancestors = list(self._inherit_from())
+            if ancestors:
+                plan.update(self._fetch_content_pks(ancestors, empty_inherited_regions))
+        return plan
+
+    def _fetch_content_pks(self, pks, regions=None):
+        """
+        Returns the plan for the content blocks of the first object in ``pks``
+        having content in the respective region, using one query.
+        """
+
+        types = self._content_types_for_template(regions)
+        if not types:
+            return {}
+
+        tmpl = ['SELECT %d AS ct_idx, parent_id, region, id, ordering FROM %s',
+            'WHERE parent_id IN (' + ','.join(['%%s'] * len(pks)) + ')']
+        args = list(pks)
+
+        if regions:
+            tmpl.append('AND region IN (' + ','.join(['%%s'] * len(regions)) + ')')
+            args.extend(regions)
+
+        tmpl = u' '.join(tmpl)
+        sql = ' UNION '.join([tmpl % (idx, cls._meta.db_table)\
+            for idx, cls in types])
+
+        cursor = connection.cursor()
+        cursor.execute(sql, args * len(types))
+
+        found = {}
+        for ct_idx, parent, region, content_pk, ordering in cursor.fetchall():
+            found.setdefault(region, {}).setdefault(parent, []).append(
+                (ordering, ct_idx, content_pk))
+
+        plan = {}
+        for region, parents in found.items():
+            pk = min(parents.keys(), key=pks.index)
+            plan[region] = [(pk, ct_idx, content_pk)
+                for ordering, ct_idx, content_pk in sorted(parents[pk])]
+        return plan
+
+    def _fetch_instances_by_pk(self, pks_by_type):
+        """
+        Loads the content blocks with the passed primary keys which have not
+        been loaded yet, using one query per type. Returns the instance
+        registry (see ``_register_instances``).
+        """
+
+        registry = self._cache['instances']
+        for ct_idx, pks in pks_by_type.items():
+            type = self.item._feincms_content_types[ct_idx]
+            missing = [pk for pk in pks if (type, pk) not in registry]
+            if missing:
+                with measure(type, 'load', instance=self.item):
+                    self._register_instances(type.get_queryset(Q(pk__in=missing)))
+        return registry
+
+    def _popuplate_content_type_caches(self, types):
+        """
+        Load all content blocks of the passed types using their primary keys
+        """
+
+        types = tuple(types)
+        pks_by_type = {}
+        for items in self._fetch_plan().values():
+            for pk, ct_idx, content_pk in items:
+                pks_by_type.setdefault(ct_idx, []).append(content_pk)
+
+        for idx, type in enumerate(self.item._feincms_content_types):
+            if issubclass(type, types) and type not in self._cache['cts']:
+                pks = pks_by_type.get(idx, [])
+                registry = self._fetch_instances_by_pk({idx: pks})
+                self._cache['cts'][type] = [registry[(type, pk)]
+                    for pk in pks if (type, pk) in registry]
+
+    def _fetch_region(self, region):
+        """
+        Returns the content blocks of a single region in inventory order,
+        loading the content blocks of all regions not loaded yet (or only
+        those of this region if ``lazy_regions`` is set).
+        """
+
+        if region not in self._cache['regions']:
+            plan = self._fetch_plan()
+            if self.lazy_regions:
+                regions = [region]
+            else:
+                regions = [key for key in set(plan) | set([region])
+                    if key not in self._cache['regions']]
+
+            pks_by_type = {}
+            for key in regions:
+                for pk, ct_idx, content_pk in plan.get(key, []):
+                    pks_by_type.setdefault(ct_idx, []).append(content_pk)
+
+            registry = self._fetch_instances_by_pk(pks_by_type)
+            types = self.item._feincms_content_types
+
+            # Content blocks which have vanished without clobbering the
+            # inventory are skipped
+            for key in regions:
+                self._cache['regions'][key] = [registry[(types[ct_idx], content_pk)]
+                    for pk, ct_idx, content_pk in plan.get(key, [])
+                    if (types[ct_idx], content_pk) in registry]
+        return self._cache['regions'][region]
 
     def _translation_map(self):
-        cls = self.item.__class__
-        if not cls in _translation_map_cache:
-            # Prime translation map and cache it in the class. This needs to be
-            # done late as opposed to at class definition time as not all information
-            # is ready, especially when we are doing a "syncdb" the ContentType table
-            # does not yet exist
-            map = {}
-            for idx, fct in enumerate(self.item._feincms_content_types):
-                dct = ContentType.objects.get_for_model(fct)
-
-                # Rely on non-negative primary keys
-                map[-dct.id] = idx # From-inventory map
-                map[idx] = dct.id  # To-inventory map
-
-            _translation_map_cache[cls] = map
-        return _translation_map_cache[cls]
+        return translation_map(self.item.__class__)
 
     def _from_inventory(self, inventory):
         """
         Transforms the inventory from Django's content types to FeinCMS's
-        ContentProxy counts format.
+        content type indices.
         """
 
         map = self._translation_map()
 
         return dict((region, [
-            (pk, map[-ct]) for pk, ct in items
+            (pk, map[-ct], content_pk) for pk, ct, content_pk in items
             ]) for region, items in inventory.items() if region!='_version_')
 
-    def _to_inventory(self, counts):
+    def _to_inventory(self, plan):
         map = self._translation_map()
 
         inventory = dict((region, [
-            (pk, map[ct]) for pk, ct in items
-            ]) for region, items in counts.items())
+            (pk, map[ct_idx], content_pk) for pk, ct_idx, content_pk in items
+            ]) for region, items in plan.items())
         inventory['_version_'] = INVENTORY_VERSION
         return inventory
 
 # ------------------------------------------------------------------------
-def class_prepared_handler(sender, **kwargs):
-    # It might happen under rare circumstances that not all model classes
-    # are fully loaded and initialized when the translation map is accessed.
-    # This leads to (lots of) crashes on the server. Better be safe and
-    # kill the translation map when any class_prepared signal is received.
-    global _translation_map_cache
-    _translation_map_cache = {}
-class_prepared.connect(class_prepared_handler)
+def translation_map(cls):
+    """
+    Returns the map between the indices into ``cls._feincms_content_types``
+    and Django's content type IDs. Negative keys map content type IDs to
+    indices, non-negative keys map indices to content type IDs.
+
+    The map is built using a single query and kept for the lifetime of the
+    process. It is rebuilt only if the content types of ``cls`` change, f.e.
+    when a content type is created after the map has been accessed for the
+    first time. If ``FEINCMS_CT_TRACKER_CACHE_TIMEOUT`` is set, the map is
+    shared between processes using Django's cache.
+    """
+
+    types = tuple(cls._feincms_content_types)
+    entry = _translation_map_cache.get(cls)
+    if entry is not None and entry[0] == types:
+        return entry[1]
+
+    timeout = settings.FEINCMS_CT_TRACKER_CACHE_TIMEOUT
+    if timeout is not None:
+        ck = path_to_cache_key(u'-'.join([cls._meta.db_table]
+            + [fct._meta.db_table for fct in types]), prefix='CT-TRACKER-MAP',
+            site_id=django_settings.SITE_ID)
+        ids = django_cache.get(ck)
+    else:
+        ids = None
+
+    if ids is None or len(ids) != len(types):
+        # This needs to be done late as opposed to at class definition time
+        # as not all information is ready, especially when we are doing a
+        # "syncdb" the ContentType table does not yet exist
+        cts = ContentType.objects.get_for_models(*types)
+        ids = [cts[fct].id for fct in types]
+        if timeout is not None:
+            django_cache.set(ck, ids, timeout)
+
+    map = {}
+    for idx, id in enumerate(ids):
+        # Rely on non-negative primary keys
+        map[-id] = idx # From-inventory map
+        map[idx] = id  # To-inventory map
+
+    _translation_map_cache[cls] = (types, map)
+    return map
+
+# ------------------------------------------------------------------------
+def compute_inventory(item):
+    """
+    Returns the inventory of the passed object, determined using the content
+    blocks in the database. Nothing is saved.
+    """
+
+    proxy = TrackerContentProxy(item)
+    return proxy._to_inventory(proxy._compute_plan())
+
+def update_inventory(item):
+    """
+    Compute and save the inventory of the passed object.
+    """
+
+    item._ct_inventory = compute_inventory(item)
+    item.__class__.objects.filter(pk=item.pk).update(
+        _ct_inventory=item._ct_inventory)
+
+    if hasattr(item, '_content_proxy'):
+        del item._content_proxy
+
 
 # ------------------------------------------------------------------------
-def tree_post_save_handler(sender, instance, **kwargs):
+def tree_post_save_handler(sender, instance, created=False, **kwargs):
     """
-    Clobber the _ct_inventory attribute of this object and all sub-objects
-    on save.
+    Clobber the _ct_inventory attribute of all sub-objects if this object has
+    been moved, because their inherited content comes from different
+    ancestors now. The inventory of the object itself has already been
+    clobbered by ``single_pre_save_handler``. Changes to content blocks in
+    inherited regions are handled by ``content_post_save_handler``.
     """
 
-    instance.get_descendants(include_self=True).update(_ct_inventory=None)
+    if not created and tree_position_changed(instance):
+        instance.get_descendants().update(_ct_inventory=None)
 
 # ------------------------------------------------------------------------
 def single_pre_save_handler(sender, instance, **kwargs):
@@ -131,14 +338,76 @@ def single_pre_save_handler(sender, instance, **kwargs):
 
     instance._ct_inventory = None
 
+# ------------------------------------------------------------------------
+def content_post_save_handler(sender, instance, **kwargs):
+    """
+    Clobber the inventory of the parent when content blocks are saved or
+    deleted outside the item editor. Descendants are clobbered too if the
+    region is inherited.
+    """
+
+    cls = getattr(sender, '_feincms_content_class', None)
+    if cls is None or not issubclass(cls.content_proxy_class, TrackerContentProxy):
+        return
+
+    # The inventory is updated once all content blocks have been saved
+    if in_bulk_content_save(cls, instance.parent_id):
+        return
+
+    # Also clobber the inventory of the parent instance if it is at hand,
+    # f.e. when using page.rawcontent_set.create(...)
+    parent = getattr(instance, sender._meta.get_field('parent').get_cache_name(), None)
+    if parent is not None:
+        parent._ct_inventory = None
+
+    inherited = any(region.inherited for region in cls._feincms_all_regions
+        if region.key == instance.region)
+
+    queryset = cls.objects.filter(pk=instance.parent_id)
+    if inherited and hasattr(cls, 'get_descendants'):
+        try:
+            queryset = instance.parent.get_descendants(include_self=True)
+        except ObjectDoesNotExist:
+            # The parent is being deleted
+            return
+
+    queryset.update(_ct_inventory=None)
+
+post_save.connect(content_post_save_handler,
+    dispatch_uid='feincms.ct_tracker.post_save')
+post_delete.connect(content_post_save_handler,
+    dispatch_uid='feincms.ct_tracker.post_delete')
+
+# ------------------------------------------------------------------------
+def update_inventory_handler(sender, instance, **kwargs):
+    """
+    Compute the inventory once the item editor has saved all content blocks,
+    so that the first visitor does not have to.
+
+    Content blocks saved in bulk did not clobber the inventories of the
+    descendants, which is done here if content blocks in inherited regions
+    have been added, changed or deleted.
+    """
+
+    update_inventory(instance)
+
+    saved = pop_saved_regions(instance)
+    if hasattr(instance, 'get_descendants') and\
+            instance.get_descendant_count() and\
+            any(region.inherited and region.key in saved
+                for region in instance.template.regions):
+        instance.get_descendants().update(_ct_inventory=None)
+
 # ------------------------------------------------------------------------
 def register(cls, admin_cls):
     cls.add_to_class('_ct_inventory', JSONField(_('content types'), editable=False, blank=True, null=True))
     cls.content_proxy_class = TrackerContentProxy
 
+    pre_save.connect(single_pre_save_handler, sender=cls)
     if hasattr(cls, 'get_descendants'):
         post_save.connect(tree_post_save_handler, sender=cls)
-    else:
-        pre_save.connect(single_pre_save_handler, sender=cls)
+
+    itemeditor_post_save_related.connect(update_inventory_handler, sender=cls)
+    content_copied.connect(update_inventory_handler, sender=cls)
 
 # ------------------------------------------------------------------------
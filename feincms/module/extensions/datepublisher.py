@@ -5,16 +5,30 @@ views and the template tags.
 
 Depends on the page class having a "active_filters" list that will be used by
 the page's manager to determine which entries are to be considered active.
+
+``next_transition`` returns the next point in time at which an object is
+published or unpublished. Caches of anything depending on the set of active
+objects (navigation, resolved paths, whole responses) are valid until then
+at most. A response processor lowering the ``max-age`` of responses
+accordingly is registered for pages.
 """
 # ------------------------------------------------------------------------
 
 from datetime import datetime
+import time
 
+from django.conf import settings as django_settings
+from django.core.cache import cache as django_cache
 from django.db import models
-from django.db.models import Q
+from django.db.models import Min, Q
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
+from django.utils.cache import get_max_age, patch_cache_control
+from django.utils.http import http_date
 from django.utils.translation import ugettext_lazy as _
 
+from feincms.utils import path_to_cache_key
+
 # ------------------------------------------------------------------------
 def format_date(d, if_none=''):
     """
@@ -44,15 +58,112 @@ def granular_now(n=None):
         n = timezone.now()
     return datetime(n.year, n.month, n.day, n.hour, (n.minute // 5) * 5)
 
+def _now():
+    # Compare with values from the database, which are aware if USE_TZ is set
+    now = granular_now()
+    if django_settings.USE_TZ:
+        now = now.replace(tzinfo=timezone.utc)
+    return now
+
+def _seconds_until(transition):
+    delta = transition - timezone.now()
+    return delta.days * 86400 + delta.seconds
+
+# ------------------------------------------------------------------------
+def _transition_key(cls):
+    # Shared by all sites, invalidation deletes the key
+    return path_to_cache_key(cls._meta.db_table, prefix='NEXT-TRANSITION',
+        site_id=django_settings.SITE_ID)
+
+def next_transition(cls):
+    """
+    Returns the next point in time at which an object of the passed class
+    is published or unpublished, or ``None`` if nothing is scheduled. Uses
+    two queries on the indexed date fields; the result is cached until that
+    point in time or until an object is saved or deleted.
+    """
+
+    ck = _transition_key(cls)
+    transition = django_cache.get(ck)
+    if transition is not None:
+        return transition or None
+
+    now = _now()
+    manager = cls._default_manager
+    candidates = [
+        manager.filter(publication_date__gt=now).aggregate(
+            transition=Min('publication_date'))['transition'],
+        manager.filter(publication_end_date__gt=now).aggregate(
+            transition=Min('publication_end_date'))['transition'],
+        ]
+    candidates = [c for c in candidates if c is not None]
+
+    if candidates:
+        transition = min(candidates)
+        # Some backends treat a timeout of 0 as "forever"
+        django_cache.set(ck, transition, max(1, _seconds_until(transition)))
+        return transition
+
+    django_cache.set(ck, False)
+    return None
+
+def seconds_until_next_transition(cls):
+    """
+    Returns the number of seconds until ``next_transition`` or ``None`` if
+    nothing is scheduled.
+    """
+
+    transition = next_transition(cls)
+    if transition is None:
+        return None
+    return max(0, _seconds_until(transition))
+
+def invalidate_next_transition(sender, **kwargs):
+    django_cache.delete(_transition_key(sender))
+
+# ------------------------------------------------------------------------
+def datepublisher_response_processor(page, request, response):
+    """
+    Lowers the ``max-age`` of the response so that it does not outlive the
+    next publication or unpublication. Only responses which are cacheable
+    already are modified; when using ``UpdateCacheMiddleware`` this means
+    all responses, because the middleware respects lower ``max-age`` values.
+    """
+
+    max_age = get_max_age(response)
+    if max_age is None:
+        if 'django.middleware.cache.UpdateCacheMiddleware' not in\
+                django_settings.MIDDLEWARE_CLASSES:
+            return
+        max_age = django_settings.CACHE_MIDDLEWARE_SECONDS
+
+    seconds = seconds_until_next_transition(page.__class__)
+    if seconds is not None and seconds < max_age:
+        patch_cache_control(response, max_age=seconds)
+        if response.has_header('Expires'):
+            response['Expires'] = http_date(time.time() + seconds)
+
 # ------------------------------------------------------------------------
 def register(cls, admin_cls):
     cls.add_to_class('publication_date', models.DateTimeField(_('publication date'),
-        default=granular_now))
+        default=granular_now, db_index=True))
     cls.add_to_class('publication_end_date', models.DateTimeField(_('publication end date'),
-        blank=True, null=True,
+        blank=True, null=True, db_index=True,
         help_text=_('Leave empty if the entry should stay active forever.')))
     cls.add_to_class('latest_children', latest_children)
 
+    # Also report the indexes as missing for existing tables (see
+    # feincms.management.checker)
+    cls.feincms_indexes = list(getattr(cls, 'feincms_indexes', ())) + [
+        ('publication_date',), ('publication_end_date',)]
+
+    post_save.connect(invalidate_next_transition, sender=cls)
+    post_delete.connect(invalidate_next_transition, sender=cls)
+
+    if hasattr(cls, 'register_response_processor'):
+        cls.register_response_processor(datepublisher_response_processor,
+            key='datepublisher')
+
     # Patch in rounding the pub and pub_end dates on save
     orig_save = cls.save
 
@@ -7,7 +7,7 @@
 #
 # ------------------------------------------------------------------------
 
-from __future__ import absolute_import
+from __future__ import absolute_import, with_statement
 
 try:
     import json
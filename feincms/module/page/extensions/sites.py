@@ -1,15 +1,83 @@
+"""
+Limit pages to sites.
+
+Pages are filtered by the site served by the current thread, which is
+``SITE_ID`` by default. Add ``SiteMiddleware`` to ``MIDDLEWARE_CLASSES`` to
+serve many sites from a single process::
+
+    MIDDLEWARE_CLASSES = (
+        'feincms.module.page.extensions.sites.SiteMiddleware',
+        ...
+    )
+
+The middleware activates the site whose domain matches the host of the
+request; requests for unknown hosts are served by the site ``SITE_ID``.
+Resolved paths, the URL index and all other cached page data are kept
+separately for every site.
+"""
+
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
 from django.db import models
+from django.db.models import signals
 from django.contrib.sites.models import Site
 
 from feincms.module.page.models import PageManager
+from feincms.utils.cache import cache_generations, invalidate_namespace,\
+    model_namespace
+from feincms.utils.sites import activate_site, current_site_id,\
+    deactivate_site
+
+
+_sites_by_host = {}
 
 
 def current_site(queryset):
-    return queryset.filter(site=Site.objects.get_current())
+    return queryset.filter(site=current_site_id())
+
+
+# ------------------------------------------------------------------------
+def site_for_host(host):
+    """
+    Returns the ID of the site whose domain matches the passed host (with or
+    without the port) or ``None`` if there is no such site.
 
+    All sites are loaded using a single query and kept in memory until a site
+    is saved or deleted (or on every call if the cache does not store
+    anything).
+    """
 
+    version = tuple(cache_generations([model_namespace(Site)]))
+    hosts = _sites_by_host.get(version)
+    if hosts is None or None in version:
+        hosts = dict((domain.lower(), pk)
+            for pk, domain in Site.objects.values_list('pk', 'domain'))
+        _sites_by_host.clear()
+        _sites_by_host[version] = hosts
+
+    host = host.lower()
+    return hosts.get(host) or hosts.get(host.split(':')[0])
+
+def invalidate_sites(sender, instance, **kwargs):
+    invalidate_namespace(model_namespace(sender))
+signals.post_save.connect(invalidate_sites, sender=Site)
+signals.post_delete.connect(invalidate_sites, sender=Site)
+
+
+class SiteMiddleware(object):
+    """
+    Activates the site matching the host of the request for the duration of
+    the request.
+    """
+
+    def process_request(self, request):
+        activate_site(site_for_host(request.get_host()))
+
+    def process_response(self, request, response):
+        deactivate_site()
+        return response
+
+# ------------------------------------------------------------------------
 def register(cls, admin_cls):
     cls.add_to_class('site',
                      models.ForeignKey(Site,
@@ -18,4 +86,8 @@ def register(cls, admin_cls):
 
     PageManager.add_to_active_filters(current_site, key='current_site')
 
+    # Paths are resolved per site
+    cls.feincms_indexes = list(getattr(cls, 'feincms_indexes', ())) + [
+        ('site', '_cached_url')]
+
     admin_cls.list_display.extend(['site'])
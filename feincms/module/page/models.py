@@ -6,7 +6,7 @@ import re
 
 from django.core.cache import cache as django_cache
 from django.conf import settings as django_settings
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import Q, signals
 from django.http import Http404
 from django.utils.datastructures import SortedDict
@@ -17,14 +17,16 @@ from mptt.models import MPTTModel
 
 from feincms import settings
 from feincms.management.checker import check_database_schema
-from feincms.models import create_base_model
-from feincms.module.page import processors
+from feincms.models import ContentManager, create_base_model
+from feincms.module.page import object_cache, processors, url_index, visibility
 from feincms.utils.managers import ActiveAwareContentManagerMixin
 
 from feincms.utils import path_to_cache_key
+from feincms.utils.cache import invalidate_namespace, model_namespace,\
+    object_namespace
 
 # ------------------------------------------------------------------------
-class PageManager(models.Manager, ActiveAwareContentManagerMixin):
+class PageManager(ContentManager, ActiveAwareContentManagerMixin):
     """
     The page manager. Only adds new methods, does not modify standard Django
     manager behavior in any way.
@@ -33,6 +35,46 @@ class PageManager(models.Manager, ActiveAwareContentManagerMixin):
     # The fields which should be excluded when creating a copy.
     exclude_from_copy = ['id', 'tree_id', 'lft', 'rght', 'level', 'redirect_to']
 
+    def _miss_cache_key(self, path, kind):
+        """
+        Returns the cache key for remembering that no page matches the passed
+        path, or ``None`` if misses should not be cached. The key is part of
+        the cache namespace of the page model, which is invalidated whenever
+        a page is saved or deleted.
+        """
+
+        if not settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT:
+            return None
+
+        return path_to_cache_key(path, prefix='PAGE-MISS-%s' % kind,
+            namespaces=(model_namespace(self.model),))
+
+    def _cache_miss(self, mk):
+        if mk:
+            django_cache.set(mk, True,
+                self._cache_timeout(settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT))
+
+    def _cache_timeout(self, timeout=None):
+        """
+        Returns the timeout for cached data depending on the set of active
+        pages: the passed timeout (or the default timeout of the cache), but
+        no longer than until the next publication or unpublication if the
+        ``datepublisher`` extension is active.
+        """
+
+        if timeout is None:
+            timeout = django_cache.default_timeout
+
+        if 'datepublisher' in self.active_filters:
+            from feincms.module.extensions.datepublisher import\
+                seconds_until_next_transition
+
+            seconds = seconds_until_next_transition(self.model)
+            if seconds is not None:
+                # Some backends treat a timeout of 0 as "forever"
+                timeout = max(1, min(timeout, seconds))
+        return timeout
+
     def page_for_path(self, path, raise404=False):
         """
         Return a page for a path. Optionally raises a 404 error if requested.
@@ -44,12 +86,16 @@ class PageManager(models.Manager, ActiveAwareContentManagerMixin):
 
         stripped = path.strip('/')
 
-        try:
-            return self.active().get(_cached_url=stripped and u'/%s/' % stripped or '/')
-        except self.model.DoesNotExist:
-            if raise404:
-                raise Http404
-            raise
+        mk = self._miss_cache_key(stripped, 'EXACT')
+        if not (mk and django_cache.get(mk)):
+            try:
+                return self.active().get(_cached_url=stripped and u'/%s/' % stripped or '/')
+            except self.model.DoesNotExist:
+                self._cache_miss(mk)
+
+        if raise404:
+            raise Http404
+        raise self.model.DoesNotExist
 
     def best_match_for_path(self, path, raise404=False):
         """
@@ -66,29 +112,51 @@ class PageManager(models.Manager, ActiveAwareContentManagerMixin):
         paths = ['/']
         path = path.strip('/')
 
-        # Cache path -> page resolving.
-        # We flush the cache entry on page saving, so the cache should always
-        # be up to date.
+        # Cache path -> page resolving. Only the primary key is cached, the
+        # page itself is cached separately (see object_cache). We flush the
+        # cache entry on page saving, so the cache should always be up to date.
 
         ck = Page.path_to_cache_key(path)
-        page = django_cache.get(ck)
-        if page:
-            return page
+        pk = django_cache.get(ck)
+        if isinstance(pk, (int, long)):
+            try:
+                return object_cache.get_page(self, pk)
+            except self.model.DoesNotExist:
+                pass
+
+        # Paths not matching any page are cached too if
+        # FEINCMS_PAGE_MISS_CACHE_TIMEOUT is set
+        mk = self._miss_cache_key(path, 'BEST-MATCH')
+        if not (mk and django_cache.get(mk)):
+            if path:
+                tokens = path.split('/')
+                paths += ['/%s/' % '/'.join(tokens[:i]) for i in range(1, len(tokens)+1)]
+
+            page = self._best_match_for_paths(paths)
+            if page is not None:
+                django_cache.set(ck, page.pk, self._cache_timeout())
+                return page
+
+            self._cache_miss(mk)
+
+        if raise404:
+            raise Http404
+        raise self.model.DoesNotExist
 
-        if path:
-            tokens = path.split('/')
-            paths += ['/%s/' % '/'.join(tokens[:i]) for i in range(1, len(tokens)+1)]
+    def _best_match_for_paths(self, paths):
+        index = settings.FEINCMS_PAGE_URL_INDEX and url_index.get_index(self.model)
+        if index:
+            pk = index.best_match(paths)
+            return pk is not None and object_cache.get_page(self, pk) or None
 
         try:
             page = self.active().filter(_cached_url__in=paths).extra(
                 select={'_url_length': 'LENGTH(_cached_url)'}).order_by('-_url_length')[0]
-            django_cache.set(ck, page)
-            return page
         except IndexError:
-            if raise404:
-                raise Http404
+            return None
 
-        raise self.model.DoesNotExist
+        object_cache.cache_page(page)
+        return page
 
     def in_navigation(self):
         """
@@ -156,6 +224,10 @@ class Page(create_base_model(MPTTModel)):
                              lambda p: p._django_content_type.id,
                              lambda p: p.id ]
 
+    #: Composite indexes recommended for this model's table, created on
+    #: ``syncdb`` and checked by ``feincms_validate``
+    feincms_indexes = [('tree_id', 'lft'), ('_cached_url', 'active')]
+
     class Meta:
         ordering = ['tree_id', 'lft']
         verbose_name = _('page')
@@ -166,6 +238,11 @@ class Page(create_base_model(MPTTModel)):
     def __unicode__(self):
         return self.short_title()
 
+    def _visible_pages(self):
+        if settings.FEINCMS_PAGE_VISIBILITY_CACHE:
+            return visibility.visible_pages(self.__class__)
+        return None
+
     def is_active(self):
         """
         Check whether this page and all its ancestors are active
@@ -174,6 +251,10 @@ class Page(create_base_model(MPTTModel)):
         if not self.pk:
             return False
 
+        visible = self._visible_pages()
+        if visible is not None:
+            return self.pk in visible
+
         pages = Page.objects.active().filter(tree_id=self.tree_id, lft__lte=self.lft, rght__gte=self.rght)
         return pages.count() > self.level
     is_active.short_description = _('is active')
@@ -186,6 +267,10 @@ class Page(create_base_model(MPTTModel)):
         if self.is_root_node():
             return True
 
+        visible = self._visible_pages()
+        if visible is not None:
+            return self.parent_id in visible
+
         queryset = PageManager.apply_active_filters(self.get_ancestors())
         return queryset.count() >= self.level
 
@@ -225,9 +310,7 @@ class Page(create_base_model(MPTTModel)):
         cached_page_urls[self.id] = self._cached_url
         super(Page, self).save(*args, **kwargs)
 
-        # Okay, we changed the URL -- remove the old stale entry from the cache
-        ck = self.path_to_cache_key(self._original_cached_url)
-        django_cache.delete(ck)
+        # The cached paths are invalidated by invalidate_page_caches
 
         # If our cached URL changed we need to update all descendants to
         # reflect the changes. Since this is a very expensive operation
@@ -240,6 +323,21 @@ class Page(create_base_model(MPTTModel)):
         # inheritance has been customized.
         pages = self.get_descendants().order_by('lft')
 
+        if settings.FEINCMS_PAGE_BULK_URL_UPDATE:
+            changed = []
+            for id, parent_id, override_url, slug in pages.values_list(
+                    'id', 'parent_id', 'override_url', 'slug'):
+                if override_url:
+                    cached_page_urls[id] = override_url
+                else:
+                    cached_page_urls[id] = u'%s%s/' % (
+                        cached_page_urls[parent_id], slug)
+                    changed.append((id, cached_page_urls[id]))
+
+            self._bulk_update_cached_urls(changed)
+            object_cache.invalidate_pks(self.__class__, [pk for pk, url in changed])
+            return
+
         for page in pages:
             if page.override_url:
                 page._cached_url = page.override_url
@@ -253,6 +351,33 @@ class Page(create_base_model(MPTTModel)):
             super(Page, page).save() # do not recurse
     save.alters_data = True
 
+    def _bulk_update_cached_urls(self, urls, batch_size=250):
+        """
+        Writes the passed ``(pk, _cached_url)`` tuples to the database using
+        one ``UPDATE`` statement per batch. Nothing else is saved and no
+        signals are sent.
+        """
+
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+
+        for offset in range(0, len(urls), batch_size):
+            batch = urls[offset:offset + batch_size]
+            args = []
+            for pk, url in batch:
+                args.extend((pk, url))
+            args.extend(pk for pk, url in batch)
+
+            cursor.execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+                qn(self._meta.db_table),
+                qn('_cached_url'),
+                qn(self._meta.pk.column),
+                ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                qn(self._meta.pk.column),
+                ', '.join(['%s'] * len(batch)),
+                ), args)
+        transaction.set_dirty()
+
     @models.permalink
     def get_absolute_url(self):
         """
@@ -381,7 +506,8 @@ class Page(create_base_model(MPTTModel)):
 
     @staticmethod
     def path_to_cache_key(path):
-        return path_to_cache_key(path.strip('/'), prefix="PAGE-FOR-URL")
+        return path_to_cache_key(path.strip('/'), prefix="PAGE-FOR-URL",
+            namespaces=(model_namespace(Page),))
 
 # ------------------------------------------------------------------------
 # Our default request processors
@@ -397,6 +523,18 @@ if settings.FEINCMS_FRONTEND_EDITING:
 
 signals.post_syncdb.connect(check_database_schema(Page, __name__), weak=False)
 
+def invalidate_page_caches(sender, instance, **kwargs):
+    """
+    Invalidates everything cached in the namespace of the page model (resolved
+    and missed paths, the URL index and the visible pages) and the cached
+    page itself.
+    """
+
+    invalidate_namespace(model_namespace(sender),
+        object_namespace(sender, instance.pk))
+signals.post_save.connect(invalidate_page_caches, sender=Page)
+signals.post_delete.connect(invalidate_page_caches, sender=Page)
+
 # ------------------------------------------------------------------------
 # Down here as to avoid circular imports
 from .modeladmins import PageAdmin
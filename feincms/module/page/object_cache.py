@@ -0,0 +1,124 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Cache of page instances.
+
+``Page.objects.best_match_for_path`` only caches the primary key of the page
+matching a path. The page itself is stored once in Django's cache, in the
+cache namespace of the page, which is invalidated when the page is saved or
+deleted. All paths served by the same page (f.e. the subpages
+of an ``ApplicationContent``) share the cached page therefore.
+
+If ``FEINCMS_PAGE_OBJECT_CACHE_SIZE`` is set, up to that many pages are
+additionally kept in a process-local LRU cache, so that frequently requested
+pages are not unpickled on every request. Copies are handed out, because
+request processors and content types store per-request state on pages.
+"""
+
+from __future__ import with_statement
+
+import copy
+from threading import Lock
+
+from django.core.cache import cache as django_cache
+from django.utils.datastructures import SortedDict
+
+from feincms import settings
+from feincms.utils import path_to_cache_key
+from feincms.utils.cache import cache_generations, invalidate_namespace,\
+    object_namespace
+
+
+# ------------------------------------------------------------------------
+class LRUCache(object):
+    """
+    Minimal thread-safe mapping holding the ``size`` most recently used items
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = SortedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.pop(key, None)
+            if value is not None:
+                self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.size:
+                # The least recently used item comes first
+                del self.data[self.data.keyOrder[0]]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+_lru = LRUCache(0)
+
+# ------------------------------------------------------------------------
+def invalidate_pks(model, pks):
+    """
+    Drops the cached pages with the passed primary keys, for pages which are
+    updated without sending signals
+    """
+
+    invalidate_namespace(*[object_namespace(model, pk) for pk in pks])
+
+# ------------------------------------------------------------------------
+def _copy(page):
+    page = copy.copy(page)
+    page._state = copy.copy(page._state)
+    return page
+
+def _object_key(model, pk):
+    generations = cache_generations([object_namespace(model, pk)])
+    if None in generations:
+        return None
+    return path_to_cache_key(u'-'.join([model._meta.db_table, unicode(pk)]
+        + generations), prefix='PAGE-OBJECT')
+
+def cache_page(page):
+    """
+    Stores a page which has just been loaded from the database
+    """
+
+    key = _object_key(page.__class__, page.pk)
+    if key is not None:
+        django_cache.set(key, page)
+
+def get_page(manager, pk):
+    """
+    Returns the page with the passed primary key from the caches, loading it
+    from the database if necessary.
+    """
+
+    key = _object_key(manager.model, pk)
+    if key is None:
+        return manager.get(pk=pk)
+
+    size = settings.FEINCMS_PAGE_OBJECT_CACHE_SIZE
+    if size:
+        _lru.size = size
+        page = _lru.get(key)
+        if page is not None:
+            return _copy(page)
+
+    page = django_cache.get(key)
+    if page is None:
+        page = manager.get(pk=pk)
+        django_cache.set(key, page)
+
+    if size:
+        _lru.set(key, page)
+        return _copy(page)
+    return page
+
+# ------------------------------------------------------------------------
@@ -0,0 +1,108 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+In-process index of the URLs of all active pages.
+
+If ``FEINCMS_PAGE_URL_INDEX`` is set, ``PageManager.best_match_for_path``
+determines the best matching page using a dictionary mapping ``_cached_url``
+to the primary key of the page instead of querying the database with all
+possible URL prefixes. Only the page itself is loaded from the database.
+
+Every process holds its own copy of the index for every site it serves (see
+``feincms.utils.sites``). Its version is the generation of the cache
+namespace of the page model, which is invalidated whenever a page is saved
+or deleted; the index is rebuilt when the version changes or when the active
+filters of the page manager have changed. A cache shared by all processes is
+required therefore; the index is not used at all if the cache does not store
+anything (f.e. with the dummy cache backend).
+
+The publication dates of the ``datepublisher`` extension are stored in the
+index and checked when looking up a path, because the outcome of the active
+filter changes with time.
+"""
+
+from django.conf import settings as django_settings
+from django.utils import timezone
+
+from feincms.utils.cache import cache_generations, model_namespace
+from feincms.utils.sites import current_site_id
+
+
+_indexes = {}
+
+
+# ------------------------------------------------------------------------
+def current_version(model):
+    """
+    Returns the current version of the index of the passed model, made up of
+    the generations of the model's cache namespace, or ``None`` if the cache
+    does not store anything.
+    """
+
+    generations = tuple(cache_generations([model_namespace(model)]))
+    if None in generations:
+        return None
+    return generations
+
+# ------------------------------------------------------------------------
+class URLIndex(object):
+    def __init__(self, model, version):
+        manager = model._default_manager
+
+        self.version = version
+        self.filters = dict(manager.active_filters)
+        self.dates = 'datepublisher' in self.filters
+
+        fields = ['pk', '_cached_url']
+        if self.dates:
+            fields.extend(['publication_date', 'publication_end_date'])
+            queryset = manager.apply_active_filters(manager.all(),
+                exclude=('datepublisher',))
+        else:
+            queryset = manager.active()
+
+        self.urls = {}
+        for row in queryset.values_list(*fields):
+            self.urls.setdefault(row[1], []).append((row[0],) + row[2:])
+
+    def best_match(self, paths):
+        """
+        Returns the primary key of the active page with the longest URL in
+        ``paths`` or ``None`` if no active page matches.
+        """
+
+        if self.dates:
+            from feincms.module.extensions.datepublisher import granular_now
+
+            now = granular_now()
+            if django_settings.USE_TZ:
+                now = now.replace(tzinfo=timezone.utc)
+
+        for path in sorted(paths, key=len, reverse=True):
+            for entry in self.urls.get(path, ()):
+                if not self.dates or (entry[1] <= now and
+                        (entry[2] is None or entry[2] > now)):
+                    return entry[0]
+        return None
+
+def get_index(model):
+    """
+    Returns an up to date index for the passed model or ``None`` if no index
+    can be used.
+    """
+
+    version = current_version(model)
+    if version is None:
+        return None
+
+    # The active filters of the sites extension depend on the current site
+    key = (model, current_site_id())
+    index = _indexes.get(key)
+    if index is None or index.version != version or\
+            index.filters != model._default_manager.active_filters:
+        index = _indexes[key] = URLIndex(model, version)
+    return index
+
+# ------------------------------------------------------------------------
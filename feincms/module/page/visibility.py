@@ -0,0 +1,79 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Cached effective visibility of pages.
+
+A page is effectively visible if the page itself and all its ancestors pass
+the active filters of the page manager. If ``FEINCMS_PAGE_VISIBILITY_CACHE``
+is set, the primary keys of all effectively visible pages are determined
+using a single query and stored in Django's cache. ``Page.is_active`` and
+``Page.are_ancestors_active`` (and therefore the ``path_active`` request
+processor and the sitemap) only look up primary keys in this set instead of
+counting the active ancestors of every page.
+
+The set is cached in the namespace of the page model and is recomputed
+whenever a page is saved, moved or deleted. If the ``datepublisher``
+extension is active, the set is also recomputed when the five minute
+interval of ``granular_now`` has passed, because pages become visible or
+invisible with time.
+"""
+
+from django.core.cache import cache as django_cache
+
+from feincms.utils import path_to_cache_key
+from feincms.utils.cache import cache_generations, model_namespace
+from feincms.utils.sites import current_site_id
+
+
+_visible_pages = {}
+
+
+# ------------------------------------------------------------------------
+def compute_visible_pages(model):
+    """
+    Returns the set of primary keys of all effectively visible pages, using
+    one query.
+    """
+
+    visible = set()
+    for pk, parent_id in model._default_manager.active().order_by(
+            'tree_id', 'lft').values_list('pk', 'parent_id'):
+        # Parents come before their children; inactive parents are missing
+        if parent_id is None or parent_id in visible:
+            visible.add(pk)
+    return visible
+
+def visible_pages(model):
+    """
+    Returns the cached set of primary keys of all effectively visible pages
+    or ``None`` if the cache does not store anything.
+    """
+
+    generations = cache_generations([model_namespace(model)])
+    if None in generations:
+        return None
+
+    key = [model._meta.db_table] + generations
+    if 'datepublisher' in model._default_manager.active_filters:
+        from feincms.module.extensions.datepublisher import granular_now
+        key.append(granular_now().strftime('%Y%m%d%H%M'))
+
+    ck = path_to_cache_key(u'-'.join(key), prefix='PAGE-VISIBILITY')
+
+    # Keep the set of the current version in memory too, unpickling a large
+    # set on every request is not free either
+    cached = _visible_pages.get((model, current_site_id()))
+    if cached is not None and cached[0] == ck:
+        return cached[1]
+
+    visible = django_cache.get(ck)
+    if visible is None:
+        visible = compute_visible_pages(model)
+        django_cache.set(ck, visible)
+
+    _visible_pages[(model, current_site_id())] = (ck, visible)
+    return visible
+
+# ------------------------------------------------------------------------
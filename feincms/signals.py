@@ -16,3 +16,17 @@ from django.dispatch import Signal
 itemeditor_post_save_related = Signal(providing_args=["instance", "created"])
 
 # ------------------------------------------------------------------------
+# This signal is sent after the content blocks of ``source`` have been
+# copied to ``instance`` using ``copy_content_from``. Content blocks which
+# have been copied using bulk inserts do not send ``post_save``.
+
+content_copied = Signal(providing_args=["instance", "source"])
+
+# ------------------------------------------------------------------------
+# This signal is sent after a phase of handling content blocks has finished,
+# f.e. after rendering a content block. It is only sent if receivers are
+# connected, see feincms.utils.instrumentation for details.
+
+content_measured = Signal(providing_args=["phase", "instance", "duration", "queries"])
+
+# ------------------------------------------------------------------------
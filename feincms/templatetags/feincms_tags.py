@@ -2,44 +2,148 @@
 # coding=utf-8
 # ------------------------------------------------------------------------
 
+from __future__ import with_statement
+
+import copy
+import threading
+
 from django import template
+from django.db import connection
 from django.template.loader import render_to_string
+from django.utils import translation
+
+from feincms import settings
+from feincms.utils.cache import render_content_cached
+from feincms.utils.instrumentation import measure
+from feincms.utils.sites import activate_site, current_site_id,\
+    deactivate_site
 
 register = template.Library()
 
 
-def _render_content(content, **kwargs):
+def _enter_render_level(request):
     # Track current render level and abort if we nest too deep. Avoids
     # crashing in recursive page contents (eg. a page list that contains
     # itself or similar).
-    request = kwargs.get('request')
     if request is not None:
         level = getattr(request, 'feincms_render_level', 0)
         if level > 10:
             # TODO: Log this
-            return
+            return False
         setattr(request, 'feincms_render_level', level + 1)
+    return True
 
-    if (request and request.COOKIES.get('frontend_editing', False) and\
-            hasattr(content, 'fe_render')):
-        r = content.fe_render(**kwargs)
-    else:
-        r = content.render(**kwargs)
 
+def _leave_render_level(request):
     if request is not None:
         level = getattr(request, 'feincms_render_level', 1)
         setattr(request, 'feincms_render_level', max(level - 1, 0))
 
+
+def _render_content_output(content, **kwargs):
+    request = kwargs.get('request')
+    with measure(content.__class__, 'render', instance=content):
+        if (request and request.COOKIES.get('frontend_editing', False) and\
+                hasattr(content, 'fe_render')):
+            return content.fe_render(**kwargs)
+        return render_content_cached(content, **kwargs)
+
+
+def _render_content(content, **kwargs):
+    request = kwargs.get('request')
+    if not _enter_render_level(request):
+        return
+
+    r = _render_content_output(content, **kwargs)
+
+    _leave_render_level(request)
     return r
 
 
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_render_thread = threading.local()
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        _render_pool_lock.acquire()
+        try:
+            if _render_pool is None:
+                from multiprocessing.pool import ThreadPool
+                _render_pool = ThreadPool(settings.FEINCMS_RENDER_THREADS)
+        finally:
+            _render_pool_lock.release()
+    return _render_pool
+
+
+def _render_content_in_thread(language, site_id, content, kwargs):
+    # The active language and site are thread-local
+    translation.activate(language)
+    activate_site(site_id)
+    _render_thread.active = True
+    try:
+        return _render_content_output(content, **kwargs)
+    finally:
+        _render_thread.active = False
+        deactivate_site()
+        translation.deactivate()
+        connection.close()
+
+
+def _render_contents_concurrently(contents, **kwargs):
+    """
+    Render content blocks with ``feincms_render_threadsafe = True`` in a thread
+    pool while rendering the other content blocks in the current thread. The
+    output is returned in the order of the passed content blocks. Every
+    content block rendered in the pool gets a copy of the template context,
+    because rendering pushes onto and pops from the context.
+    """
+
+    request = kwargs.get('request')
+    if not _enter_render_level(request):
+        return
+
+    pool = _get_render_pool()
+    language = translation.get_language()
+    site_id = current_site_id()
+
+    results = []
+    for content in contents:
+        if getattr(content, 'feincms_render_threadsafe', False):
+            task_kwargs = dict(kwargs, context=copy.copy(kwargs.get('context')))
+            results.append(pool.apply_async(_render_content_in_thread,
+                (language, site_id, content, task_kwargs)))
+        else:
+            results.append(None)
+
+    output = []
+    for content, result in zip(contents, results):
+        if result is None:
+            output.append(_render_content_output(content, **kwargs))
+        else:
+            output.append(result.get())
+
+    _leave_render_level(request)
+    return u''.join(output)
+
+
 @register.simple_tag(takes_context=True)
 def feincms_render_region(context, feincms_object, region, request):
     """
     {% feincms_render_region feincms_page "main" request %}
     """
+    contents = getattr(feincms_object.content, region)
+
+    # Content blocks rendered in the pool render their regions sequentially,
+    # waiting for nested tasks in the same bounded pool could deadlock
+    if settings.FEINCMS_RENDER_THREADS and len(contents) > 1 and\
+            not getattr(_render_thread, 'active', False) and any(
+            getattr(content, 'feincms_render_threadsafe', False) for content in contents):
+        return _render_contents_concurrently(contents, request=request, context=context)
+
     return u''.join(_render_content(content, request=request, context=context)
-        for content in getattr(feincms_object.content, region))
+        for content in contents)
 
 
 @register.simple_tag(takes_context=True)
@@ -30,7 +30,7 @@ from feincms.content.raw.models import RawContent
 from feincms.content.richtext.models import RichTextContent
 
 from feincms.context_processors import add_page_if_missing
-from feincms.models import ContentProxy
+from feincms.models import ContentProxy, EagerContentProxy
 from feincms.module.medialibrary.models import Category, MediaFile
 from feincms.module.page import processors
 from feincms.module.page.models import Page
@@ -349,6 +349,9 @@ class PagesTestCase(TestCase):
         page = Page.objects.get(pk=1)
         response = self.create_pagecontent(page)
         self.assertRedirects(response, '/admin/page/page/')
+
+        # The item editor has updated the content type inventory
+        page = Page.objects.get(pk=1)
         self.assertEqual(page.content.main[0].__class__.__name__, 'RawContent')
 
         page2 = Page.objects.get(pk=2)
@@ -377,6 +380,7 @@ class PagesTestCase(TestCase):
 
         page = Page.objects.get(pk=1)
         self.create_pagecontent(page)
+        page = Page.objects.get(pk=1)
 
         category = Category.objects.create(title='Category', parent=None)
         category2 = Category.objects.create(title='Something', parent=category)
@@ -522,9 +526,10 @@ class PagesTestCase(TestCase):
         page2.content_proxy_class = ContentProxy
 
         if hasattr(self, 'assertNumQueries'):
-        # 4 queries: Two to get the content types of page and page2, one to
-            # fetch all ancestor PKs of page2 and one to materialize the RawContent
-            # instances belonging to page's sidebar and page2's main.
+            # 4 queries: Two to get the content types of page2 and of its
+            # ancestors, one to fetch all ancestor PKs of page2 and one to
+            # materialize the RawContent instances belonging to page's sidebar
+            # and page2's main.
             self.assertNumQueries(4, lambda: [page2.content.main, page2.content.sidebar])
             self.assertNumQueries(0, lambda: page2.content.sidebar[0].render())
 
@@ -541,12 +546,10 @@ class PagesTestCase(TestCase):
 
         if hasattr(self, 'assertNumQueries'):
             # 5 queries: Two to get the content types of page and page2, one to
-            # fetch all ancestor PKs of page2 and one to materialize the RawContent
-            # instances belonging to page's sidebar and page2's main and a few
-            # queries to update the pages _ct_inventory attributes:
-            # - one update to update page2
-            # - one update to clobber the _ct_inventory attribute of all descendants
-            #   of page2
+            # fetch all ancestor PKs of page2, one to materialize the RawContent
+            # instances belonging to page's sidebar and page2's main and one
+            # update to save the _ct_inventory attribute of page2. The
+            # inventories of the descendants of page2 are left alone.
             self.assertNumQueries(5, lambda: [page2.content.main, page2.content.sidebar])
             self.assertNumQueries(0, lambda: page2.content.sidebar[0].render())
 
@@ -576,6 +579,7 @@ class PagesTestCase(TestCase):
         self.create_default_page_set()
         page = Page.objects.get(pk=1)
         self.create_pagecontent(page)
+        page = Page.objects.get(pk=1)
 
         # this should return a 404
         self.is_published('/admin/page/page/10|rawcontent|1/', should_be=False)
@@ -1377,3 +1381,975 @@ class PagesTestCase(TestCase):
         self.assertEquals(r.status_code, 404)
 
         feincms_settings.FEINCMS_ALLOW_EXTRA_PATH = old
+
+    def test_36_prefetch_content(self):
+        self.create_default_page_set()
+        self.create_page('Another child page', 1)
+
+        page1 = Page.objects.get(pk=1)
+        page1.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar')
+        for page in Page.objects.filter(parent=page1):
+            page.rawcontent_set.create(region='main', ordering=1, text='Second %s' % page.pk)
+            page.rawcontent_set.create(region='main', ordering=0, text='First %s' % page.pk)
+
+        pages = Page.objects.filter(parent=page1).order_by('pk').prefetch_content(regions=('main',))
+
+        if hasattr(self, 'assertNumQueries'):
+            # One query for the pages and one for each content type
+            self.assertNumQueries(1 + len(Page._feincms_content_types),
+                lambda: list(pages._clone()))
+
+            pages = list(pages)
+            self.assertNumQueries(0, lambda: [page.content.main for page in pages])
+        else:
+            pages = list(pages)
+
+        self.assertEqual([u''.join(c.render() for c in page.content.main) for page in pages],
+            [u'First 2Second 2', u'First 3Second 3'])
+
+        # The empty inherited sidebar is not prefetched
+        self.assertEqual(pages[0].content.sidebar[0].render(), 'Sidebar')
+
+    def test_37_eager_content_proxy(self):
+        self.create_default_page_set()
+        self.create_page('Grandchild page', 2)
+
+        page1 = Page.objects.get(pk=1)
+        page1.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar 1')
+        page1.rawcontent_set.create(region='main', ordering=0, text='Main 1')
+        page2 = Page.objects.get(pk=2)
+        page2.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar 2')
+
+        page3 = Page.objects.get(pk=3)
+        page3.rawcontent_set.create(region='main', ordering=1, text='Second')
+        page3.rawcontent_set.create(region='main', ordering=0, text='First')
+        page3.content_proxy_class = EagerContentProxy
+
+        if hasattr(self, 'assertNumQueries'):
+            # One query per content type, one query to find out that page2
+            # is nearer than page1
+            self.assertNumQueries(len(Page._feincms_content_types) + 1,
+                lambda: [page3.content.main, page3.content.sidebar, page3.content.media])
+            self.assertNumQueries(0,
+                lambda: page3.content.all_of_type(RawContent))
+
+        self.assertEqual(u''.join(c.render() for c in page3.content.main), 'FirstSecond')
+        self.assertEqual(page3.content.sidebar[0].render(), 'Sidebar 2')
+        self.assertEqual(len(page3.content.all_of_type(RawContent)), 3)
+
+        page1.content_proxy_class = EagerContentProxy
+        self.assertEqual(page1.content.main[0].render(), 'Main 1')
+        self.assertEqual(page1.content.sidebar[0].render(), 'Sidebar 1')
+
+    def test_38_inherited_regions_single_query(self):
+        self.create_default_page_set()
+        self.create_page('Grandchild page', 2)
+        self.create_page('Great-grandchild page', 3)
+
+        page1 = Page.objects.get(pk=1)
+        page1.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar 1')
+        page2 = Page.objects.get(pk=2)
+        page2.rawcontent_set.create(region='main', ordering=0, text='Main 2')
+
+        page4 = Page.objects.get(pk=4)
+        page4.content_proxy_class = ContentProxy
+
+        if hasattr(self, 'assertNumQueries'):
+            # Content types of page4, ancestor PKs, content types of all
+            # ancestors, regardless of the depth of the page tree
+            self.assertNumQueries(3, lambda: page4.content._fetch_content_type_counts())
+
+        self.assertEqual(page4.content._fetch_content_type_counts(), {
+            'sidebar': [(1, Page._feincms_content_types.index(Page.content_type_for(RawContent)))],
+            })
+        self.assertEqual(page4.content.sidebar[0].render(), 'Sidebar 1')
+        self.assertEqual(page4.content.main, [])
+
+        page2.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar 2')
+        page4 = Page.objects.get(pk=4)
+        page4.content_proxy_class = ContentProxy
+        self.assertEqual(page4.content.sidebar[0].render(), 'Sidebar 2')
+
+    def test_39_content_cache(self):
+        from django.core.cache import cache
+        from feincms.module.extensions.content_cache import CachedContentProxyMixin
+
+        cache.clear()
+        self.create_default_page_set()
+
+        page1 = Page.objects.get(pk=1)
+        page1.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar')
+        page2 = Page.objects.get(pk=2)
+        page2.rawcontent_set.create(region='main', ordering=1, text='Second')
+        page2.rawcontent_set.create(region='main', ordering=0, text='First')
+
+        old = Page.content_proxy_class
+        Page.content_proxy_class = type('CachedContentProxy',
+            (CachedContentProxyMixin, ContentProxy), {})
+
+        try:
+            page2 = Page.objects.get(pk=2)
+            self.assertEqual(u''.join(c.render() for c in page2.content.main), 'FirstSecond')
+
+            page2 = Page.objects.get(pk=2)
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(0, lambda: [page2.content.main,
+                    page2.content.sidebar, page2.content.all_of_type(RawContent)])
+
+            self.assertEqual(u''.join(c.render() for c in page2.content.main), 'FirstSecond')
+            self.assertEqual(page2.content.sidebar[0].render(), 'Sidebar')
+            self.assertEqual(page2.content.main[0].parent, page2)
+            self.assertEqual(len(page2.content.all_of_type(RawContent)), 3)
+
+            # Changing inherited content invalidates the cache of descendants
+            content = page1.rawcontent_set.get()
+            content.text = 'Changed'
+            content.save()
+
+            page2 = Page.objects.get(pk=2)
+            self.assertEqual(page2.content.sidebar[0].render(), 'Changed')
+
+            # Saving a page only invalidates the cache of descendants if the
+            # page has been moved
+            from django.db.models.signals import post_save
+            from feincms.module.extensions.content_cache import\
+                content_cache_key, item_post_save_handler
+
+            post_save.connect(item_post_save_handler, sender=Page)
+            try:
+                page1 = Page.objects.get(pk=1)
+                page1.title = 'Changed title'
+                if hasattr(self, 'assertNumQueries'):
+                    # No descendants are loaded
+                    self.assertNumQueries(2, lambda: page1.save())
+                else:
+                    page1.save()
+                self.assertEqual(cache.get(content_cache_key(page1)), None)
+                self.assertNotEqual(cache.get(content_cache_key(page2)), None)
+
+                page3 = Page.objects.create(title='page3', slug='page3')
+                page1 = Page.objects.get(pk=1)
+                page1.parent = page3
+                page1.save()
+                self.assertEqual(cache.get(content_cache_key(page2)), None)
+            finally:
+                post_save.disconnect(item_post_save_handler, sender=Page)
+        finally:
+            Page.content_proxy_class = old
+
+    def test_40_render_cache(self):
+        self.create_default_page_set()
+
+        page = Page.objects.get(pk=1)
+        type = Page.content_type_for(RawContent)
+        content = page.rawcontent_set.create(region='main', ordering=0, text='Cached')
+
+        request = Empty()
+        request.COOKIES = {}
+        request.path = '/'
+
+        # Not cacheable by default
+        type.objects.filter(pk=content.pk).update(text='Changed')
+        content = type.objects.get(pk=content.pk)
+        self.assertEqual(feincms_tags._render_content(content, request=request), 'Changed')
+
+        type.feincms_cache_timeout = 60
+        type.feincms_cache_vary_on = ('path',)
+        try:
+            self.assertEqual(feincms_tags._render_content(content, request=request), 'Changed')
+            type.objects.filter(pk=content.pk).update(text='Not yet')
+            content = type.objects.get(pk=content.pk)
+            self.assertEqual(feincms_tags._render_content(content, request=request), 'Changed')
+
+            request.path = '/other/'
+            self.assertEqual(feincms_tags._render_content(content, request=request), 'Not yet')
+            request.path = '/'
+
+            # Saving invalidates the cached output
+            content.save()
+            self.assertEqual(feincms_tags._render_content(content, request=request), 'Not yet')
+        finally:
+            del type.feincms_cache_timeout
+            del type.feincms_cache_vary_on
+
+    def test_41_concurrent_rendering(self):
+        self.create_default_page_set()
+
+        page = Page.objects.get(pk=1)
+        type = Page.content_type_for(RawContent)
+        for i in range(5):
+            page.rawcontent_set.create(region='main', ordering=i, text='%s,' % i)
+
+        request = Empty()
+        request.COOKIES = {}
+
+        old = feincms_settings.FEINCMS_RENDER_THREADS
+        feincms_settings.FEINCMS_RENDER_THREADS = 2
+        type.feincms_render_threadsafe = True
+        try:
+            page = Page.objects.get(pk=1)
+            self.assertEqual(feincms_tags.feincms_render_region(None, page, 'main', request),
+                '0,1,2,3,4,')
+            self.assertEqual(request.feincms_render_level, 0)
+
+            # Every content block rendered in the pool gets a copy of the
+            # context, so that pushing and popping does not interfere
+            from django.template import Context
+            context = Context({'var': 'value'})
+            contexts = []
+            render = type.render
+            type.render = lambda self, **kwargs: contexts.append(
+                kwargs['context']) or render(self, **kwargs)
+            try:
+                feincms_tags.feincms_render_region(context, page, 'main', request)
+            finally:
+                type.render = render
+            self.assertEqual(len(contexts), 5)
+            self.assertEqual(len(set(id(c) for c in contexts)), 5)
+            self.assertTrue(all(c['var'] == 'value' for c in contexts))
+
+            # Content blocks rendering regions themselves do not wait for
+            # tasks queued behind them in the pool
+            for i in range(2):
+                page.rawcontent_set.create(region='sidebar', ordering=i, text='s%s,' % i)
+            page = Page.objects.get(pk=1)
+            # Worker threads cannot access the test database
+            page.content.sidebar
+            render = type.render
+            type.render = lambda self, **kwargs: self.region == 'main' and\
+                feincms_tags.feincms_render_region(None, page, 'sidebar', request) or\
+                render(self, **kwargs)
+            try:
+                self.assertEqual(feincms_tags.feincms_render_region(None, page, 'main', request),
+                    's0,s1,' * 5)
+            finally:
+                type.render = render
+        finally:
+            del type.feincms_render_threadsafe
+            feincms_settings.FEINCMS_RENDER_THREADS = old
+
+    def test_42_streaming_handler(self):
+        from django.test.client import RequestFactory
+        from feincms.views.cbv.views import Handler
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.active = True
+        page.template_key = 'theother'
+        page.save()
+        page.rawcontent_set.create(region='main', ordering=0, text='Streamed content')
+
+        factory = RequestFactory()
+        response = Handler.as_view()(factory.get(page.get_absolute_url()))
+        response.render()
+
+        response2 = Handler.as_view(streaming=True)(factory.get(page.get_absolute_url()))
+        chunks = list(response2)
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), response.content)
+        self.assertTrue('Streamed content' in response.content)
+
+        # The language of the request is active while streaming, although
+        # LocaleMiddleware has deactivated it already
+        from django.template import Context, Template
+        from django.utils import translation
+        from feincms.utils.templates import stream_template
+
+        translation.activate('de')
+        stream = stream_template(Template('{{ language }}'),
+            Context({'language': translation.get_language}))
+        translation.deactivate()
+        self.assertEqual(u''.join(stream), u'de')
+
+    def test_43_lazy_region_loading(self):
+        self.create_default_page_set()
+
+        page = Page.objects.get(pk=1)
+        page.rawcontent_set.create(region='main', ordering=0, text='Main')
+        page.rawcontent_set.create(region='sidebar', ordering=0, text='Sidebar')
+
+        class LazyContentProxy(ContentProxy):
+            lazy_regions = True
+
+        page = Page.objects.get(pk=1)
+        page.content_proxy_class = LazyContentProxy
+        main = page.content.main
+        self.assertEqual(page.content._cache['regions'].keys(), ['main'])
+        self.assertEqual(main[0].render(), 'Main')
+
+        # Loading all content returns the already materialized instances
+        contents = page.content.all_of_type(RawContent)
+        self.assertEqual(len(contents), 2)
+        self.assertTrue(main[0] in contents)
+        self.assertTrue(any(c is main[0] for c in contents))
+        self.assertTrue(page.content.main[0] is main[0])
+
+    def test_44_template_content_type_pruning(self):
+        self.create_default_page_set()
+
+        page = Page.objects.get(pk=1)
+        page.rawcontent_set.create(region='main', ordering=0, text='Hello')
+        type = Page.content_type_for(RawContent)
+
+        regions = page.template.regions
+        saved = [region._content_types[:] for region in regions]
+        for region in regions:
+            region._content_types.remove(type)
+        Page._feincms_template_content_types = {}
+
+        try:
+            page = Page.objects.get(pk=1)
+            page.content_proxy_class = ContentProxy
+            types = [cls for idx, cls in page.content._content_types_for_template()]
+
+            self.assertFalse(type in types)
+            self.assertTrue(Page.content_type_for(ImageContent) in types)
+            self.assertEqual(page.content.main, [])
+        finally:
+            for region, content_types in zip(regions, saved):
+                region._content_types[:] = content_types
+            Page._feincms_template_content_types = {}
+
+        page = Page.objects.get(pk=1)
+        page.content_proxy_class = ContentProxy
+        self.assertEqual(page.content.main[0].render(), 'Hello')
+
+    def test_45_bulk_copy_content(self):
+        self.create_default_page_set()
+
+        page = Page.objects.get(pk=1)
+        for i in range(5):
+            page.rawcontent_set.create(region='main', ordering=i, text='%s,' % i)
+
+        page2 = Page.objects.get(pk=2)
+        if hasattr(self, 'assertNumQueries'):
+            # One query per content type to fetch the content blocks, one
+            # bulk insert for the RawContent blocks and four queries to update
+            # the content type inventory (see ct_tracker)
+            self.assertNumQueries(len(Page._feincms_content_types) + 1 + 4,
+                lambda: page2.copy_content_from(page))
+        else:
+            page2.copy_content_from(page)
+
+        self.assertEqual(u''.join(c.render() for c in page2.content.main), '0,1,2,3,4,')
+
+        # Content types overriding save() are copied one by one
+        type = Page.content_type_for(RawContent)
+        type.feincms_copy_with_save = True
+        try:
+            self.create_page('Third page')
+            page3 = Page.objects.get(pk=3)
+            if hasattr(self, 'assertNumQueries'):
+                # The inventory is only updated once after saving all blocks;
+                # page3 has no ancestors, so only one count query and the
+                # update are needed
+                self.assertNumQueries(len(Page._feincms_content_types) + 5 + 2,
+                    lambda: page3.copy_content_from(page))
+        finally:
+            del type.feincms_copy_with_save
+
+        # Copying content of inherited regions clobbers the inventories of
+        # the descendants, copying other content does not
+        Page.objects.get(pk=2).content.main
+        self.assertTrue(Page.objects.get(pk=2)._ct_inventory)
+        Page.objects.get(pk=1).copy_content_from(page3)
+        self.assertTrue(Page.objects.get(pk=2)._ct_inventory)
+
+        page3.rawcontent_set.create(region='sidebar', ordering=0, text='Side')
+        Page.objects.get(pk=1).copy_content_from(page3)
+        self.assertFalse(Page.objects.get(pk=2)._ct_inventory)
+
+        page2.replace_content_with(page3)
+        self.assertEqual(len(Page.objects.get(pk=2).content.main), 5)
+        self.assertEqual(len(Page.objects.get(pk=2).content.sidebar), 1)
+
+    def test_46_content_instrumentation(self):
+        from feincms.signals import content_measured
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.active = True
+        page.template_key = 'theother'
+        page.save()
+        page.rawcontent_set.create(region='main', ordering=0, text='Measured')
+
+        type = Page.content_type_for(RawContent)
+        events = []
+
+        def receiver(sender, phase, duration, queries, **kwargs):
+            events.append((sender, phase, queries))
+        content_measured.connect(receiver)
+
+        try:
+            self.assertContains(self.client.get(page.get_absolute_url()), 'Measured')
+        finally:
+            content_measured.disconnect(receiver)
+
+        self.assertTrue((Page, 'counts', 1) in events)
+        self.assertTrue((type, 'load', 1) in events)
+        self.assertTrue((type, 'render', 0) in events)
+
+        # Nothing is sent without receivers
+        del events[:]
+        self.client.get(page.get_absolute_url())
+        self.assertEqual(events, [])
+
+    def test_47_ct_inventory_precomputed(self):
+        from django.core.management import call_command
+        from feincms.module.extensions.ct_tracker import INVENTORY_VERSION
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        self.create_pagecontent(page)
+
+        # The item editor computes the inventory right away
+        page = Page.objects.get(pk=1)
+        self.assertEqual(page._ct_inventory['_version_'], INVENTORY_VERSION)
+        self.assertTrue(page._ct_inventory['main'])
+
+        Page.objects.update(_ct_inventory=None)
+        call_command('update_ct_inventories')
+
+        for page in Page.objects.all():
+            self.assertTrue(page._ct_inventory)
+
+        page = Page.objects.get(pk=1)
+        if hasattr(self, 'assertNumQueries'):
+            self.assertNumQueries(0, lambda: page.content._fetch_content_type_counts())
+
+    def test_48_selective_ct_inventory_invalidation(self):
+        from django.core.management import call_command
+
+        self.create_default_page_set()
+        page2 = Page.objects.get(pk=2)
+        Page.objects.create(title='page3', slug='page3', parent=page2)
+        Page.objects.create(title='page4', slug='page4', parent=None)
+
+        def inventories():
+            return dict((p.pk, bool(p._ct_inventory)) for p in Page.objects.all())
+
+        call_command('update_ct_inventories')
+
+        # Saving a page only clobbers its own inventory
+        page1 = Page.objects.get(pk=1)
+        page1.title = 'Changed title'
+        page1.save()
+        self.assertEqual(inventories(), {1: False, 2: True, 3: True, 4: True})
+
+        # Moving a page clobbers the inventories of all its descendants
+        call_command('update_ct_inventories')
+        page2 = Page.objects.get(pk=2)
+        page2.parent = Page.objects.get(pk=4)
+        page2.save()
+        self.assertEqual(inventories(), {1: True, 2: False, 3: False, 4: True})
+
+        # The same applies to moves using the tree editor
+        call_command('update_ct_inventories')
+        self.client.post('/admin/page/page/', {
+            '__cmd': 'move_node',
+            'position': 'last-child',
+            'cut_item': '4',
+            'pasted_on': '1',
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(inventories(), {1: True, 2: False, 3: False, 4: False})
+
+        # Saving content blocks in the item editor only clobbers the
+        # inventories of descendants if an inherited region has been changed
+        call_command('update_ct_inventories')
+        self.create_pagecontent(Page.objects.get(pk=1))
+        self.assertEqual(inventories(), {1: True, 2: True, 3: True, 4: True})
+
+        self.create_pagecontent(Page.objects.get(pk=1), **{
+            'rawcontent_set-0-region': 'sidebar'})
+        self.assertEqual(inventories(), {1: True, 2: False, 3: False, 4: False})
+
+    def test_49_ct_inventory_content_pks(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page2 = Page.objects.get(pk=2)
+
+        page.rawcontent_set.create(region='sidebar', ordering=0, text='Inherited')
+        second = page2.rawcontent_set.create(region='main', ordering=2, text='Second')
+        first = page2.rawcontent_set.create(region='main', ordering=1, text='First')
+
+        page2 = Page.objects.get(pk=2)
+        self.assertEqual([c.text for c in page2.content.main], ['First', 'Second'])
+
+        # The inventory lists the content blocks in region order, including
+        # the content blocks inherited from the parent
+        page2 = Page.objects.get(pk=2)
+        raw = ContentType.objects.get_for_model(page2.rawcontent_set.model).id
+        self.assertEqual(page2._ct_inventory['main'],
+            [[2, raw, first.pk], [2, raw, second.pk]])
+        self.assertEqual(page2._ct_inventory['sidebar'],
+            [[1, raw, page.rawcontent_set.get().pk]])
+
+        # One query for all regions, using primary keys only
+        if hasattr(self, 'assertNumQueries'):
+            self.assertNumQueries(1, lambda: [page2.content.main, page2.content.sidebar])
+        self.assertEqual([c.text for c in page2.content.main], ['First', 'Second'])
+        self.assertEqual([c.text for c in page2.content.sidebar], ['Inherited'])
+
+        self.assertEqual(len(page2.content.all_of_type(RawContent)), 3)
+
+    def test_50_ct_tracker_translation_map(self):
+        from feincms.module.extensions import ct_tracker
+
+        ct_tracker._translation_map_cache.clear()
+        ContentType.objects.clear_cache()
+
+        # One query for all content types, none afterwards
+        if hasattr(self, 'assertNumQueries'):
+            self.assertNumQueries(1, lambda: ct_tracker.translation_map(Page))
+            self.assertNumQueries(0, lambda: ct_tracker.translation_map(Page))
+
+        map = ct_tracker.translation_map(Page)
+        for idx, type in enumerate(Page._feincms_content_types):
+            ct = ContentType.objects.get_for_model(type)
+            self.assertEqual(map[idx], ct.id)
+            self.assertEqual(map[-ct.id], idx)
+
+        # The map can be shared between processes using the cache
+        ct_tracker.settings.FEINCMS_CT_TRACKER_CACHE_TIMEOUT = 60
+        try:
+            ct_tracker._translation_map_cache.clear()
+            ct_tracker.translation_map(Page)
+
+            ct_tracker._translation_map_cache.clear()
+            ContentType.objects.clear_cache()
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(0, lambda: ct_tracker.translation_map(Page))
+            self.assertEqual(ct_tracker.translation_map(Page), map)
+        finally:
+            ct_tracker.settings.FEINCMS_CT_TRACKER_CACHE_TIMEOUT = None
+
+    def test_51_url_index(self):
+        from django.core.cache import cache
+        from feincms.module.extensions import datepublisher
+        from feincms.module.page import url_index
+
+        self.create_default_page_set()
+        page1 = Page.objects.get(pk=1)
+        page1.active = True
+        page1.save()
+        page2 = Page.objects.get(pk=2)
+        page2.active = True
+        page2.save()
+
+        feincms_settings.FEINCMS_PAGE_URL_INDEX = True
+        try:
+            url_index._indexes.clear()
+            cache.clear()
+            Site.objects.get_current()
+            datepublisher.next_transition(Page)
+
+            # Building the index and loading the page
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(2,
+                    lambda: Page.objects.best_match_for_path('/test-page/'))
+
+                # Only the page is loaded afterwards, unknown paths do not
+                # hit the database at all
+                self.assertNumQueries(1, lambda: Page.objects.best_match_for_path(
+                    '/test-page/test-child-page/something/'))
+                self.assertRaises(Page.DoesNotExist, lambda: self.assertNumQueries(0,
+                    lambda: Page.objects.best_match_for_path('/blabla/')))
+
+            self.assertEqual(Page.objects.best_match_for_path(
+                '/test-page/test-child-page/hello/'), page2)
+            self.assertRaises(Http404, lambda: Page.objects.best_match_for_path(
+                '/blabla/blabla/', raise404=True))
+
+            # Saving a page invalidates the index and all resolved paths
+            page2.active = False
+            page2.save()
+            self.assertEqual(Page.objects.best_match_for_path(
+                '/test-page/test-child-page/hello/'), page1)
+
+            # Pages which are not published yet are not found
+            page1.publication_date = datetime(2100, 1, 1)
+            page1.save()
+            self.assertRaises(Page.DoesNotExist, lambda: Page.objects.best_match_for_path(
+                '/test-page/another/'))
+        finally:
+            feincms_settings.FEINCMS_PAGE_URL_INDEX = False
+
+    def test_52_cached_misses(self):
+        from django.core.cache import cache
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+
+        feincms_settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT = 60
+        try:
+            cache.clear()
+            Site.objects.get_current()
+
+            self.assertRaises(Page.DoesNotExist,
+                lambda: Page.objects.best_match_for_path('/test-page/hello/'))
+            self.assertRaises(Http404,
+                lambda: Page.objects.page_for_path('/test-page/', raise404=True))
+
+            # Misses are answered from the cache
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(0, lambda: self.assertRaises(Http404,
+                    lambda: Page.objects.best_match_for_path('/test-page/hello/', raise404=True)))
+                self.assertNumQueries(0, lambda: self.assertRaises(Page.DoesNotExist,
+                    lambda: Page.objects.page_for_path('/test-page/')))
+
+            # Saving a page drops all cached misses
+            page.active = True
+            page.save()
+            self.assertEqual(Page.objects.best_match_for_path('/test-page/hello/'), page)
+            self.assertEqual(Page.objects.page_for_path('/test-page/'), page)
+        finally:
+            feincms_settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT = None
+
+    def test_53_bulk_url_update(self):
+        self.create_default_page_set()
+        page1 = Page.objects.get(pk=1)
+        page2 = Page.objects.get(pk=2)
+        Page.objects.create(title='page3', slug='page3', parent=page2)
+        page4 = Page.objects.create(title='page4', slug='page4', parent=page2,
+            override_url='/elsewhere/')
+        Page.objects.create(title='page5', slug='page5', parent=page4)
+
+        feincms_settings.FEINCMS_PAGE_BULK_URL_UPDATE = True
+        try:
+            page1 = Page.objects.get(pk=1)
+            page1.slug = 'moved'
+            page1.save()
+        finally:
+            feincms_settings.FEINCMS_PAGE_BULK_URL_UPDATE = False
+
+        self.assertEqual(dict(Page.objects.values_list('id', '_cached_url')), {
+            1: '/moved/',
+            2: '/moved/test-child-page/',
+            3: '/moved/test-child-page/page3/',
+            4: '/elsewhere/',
+            5: '/elsewhere/page5/',
+            })
+
+    def test_54_visibility_cache(self):
+        from django.core.cache import cache
+
+        self.create_default_page_set()
+        page1 = Page.objects.get(pk=1)
+        page2 = Page.objects.get(pk=2)
+        page2.active = True
+        page2.save()
+        page3 = Page.objects.create(title='page3', slug='page3', parent=page2)
+
+        feincms_settings.FEINCMS_PAGE_VISIBILITY_CACHE = True
+        try:
+            cache.clear()
+            Site.objects.get_current()
+
+            # page1 is inactive, therefore nothing is visible
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(1, lambda: page3.is_active())
+                self.assertNumQueries(0, lambda: page3.are_ancestors_active())
+            self.assertFalse(page2.is_active())
+            self.assertFalse(page2.are_ancestors_active())
+            self.assertFalse(page3.are_ancestors_active())
+            self.assertTrue(page1.are_ancestors_active())
+
+            page1.active = True
+            page1.save()
+            page3 = Page.objects.get(pk=3)
+            self.assertTrue(page1.is_active())
+            self.assertTrue(page3.is_active())
+
+            # Pages which are not published yet are not visible, neither are
+            # their descendants
+            page2 = Page.objects.get(pk=2)
+            page2.publication_date = datetime(2100, 1, 1)
+            page2.save()
+            page3 = Page.objects.get(pk=3)
+            self.assertFalse(page2.is_active())
+            self.assertFalse(page3.is_active())
+            self.assertFalse(page3.are_ancestors_active())
+        finally:
+            feincms_settings.FEINCMS_PAGE_VISIBILITY_CACHE = False
+
+        self.assertFalse(page3.is_active())
+        self.assertFalse(page3.are_ancestors_active())
+
+    def test_55_next_transition(self):
+        from django.core.cache import cache
+        from django.http import HttpResponse
+        from django.utils.cache import get_max_age, patch_cache_control
+        from feincms.module.extensions import datepublisher
+
+        self.create_default_page_set()
+        cache.clear()
+
+        self.assertEqual(datepublisher.next_transition(Page), None)
+        if hasattr(self, 'assertNumQueries'):
+            self.assertNumQueries(0, lambda: datepublisher.next_transition(Page))
+
+        page1 = Page.objects.get(pk=1)
+        page1.publication_end_date = datetime(2100, 1, 1)
+        page1.save()
+        page2 = Page.objects.get(pk=2)
+        page2.publication_date = datetime(2090, 1, 1)
+        page2.save()
+
+        self.assertEqual(datepublisher.next_transition(Page), datetime(2090, 1, 1))
+        self.assertEqual(datepublisher.seconds_until_next_transition(Page) // 86400,
+            (datetime(2090, 1, 1) - datetime.now()).days)
+
+        # The max-age of cacheable responses is lowered if necessary
+        response = HttpResponse()
+        datepublisher.datepublisher_response_processor(page1, None, response)
+        self.assertEqual(get_max_age(response), None)
+
+        patch_cache_control(response, max_age=600)
+        datepublisher.datepublisher_response_processor(page1, None, response)
+        self.assertEqual(get_max_age(response), 600)
+
+        page2.publication_date = datetime.now() + timedelta(minutes=6)
+        page2.save()
+        datepublisher.datepublisher_response_processor(page1, None, response)
+        self.assertTrue(0 < get_max_age(response) <= 360)
+
+    def test_56_page_object_cache(self):
+        from django.core.cache import cache
+        from feincms.module.extensions import datepublisher
+        from feincms.module.page import object_cache
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.active = True
+        page.save()
+
+        cache.clear()
+        Site.objects.get_current()
+        datepublisher.next_transition(Page)
+
+        # Resolving the path loads the page, other paths served by the same
+        # page only need to be resolved
+        if hasattr(self, 'assertNumQueries'):
+            self.assertNumQueries(1,
+                lambda: Page.objects.best_match_for_path('/test-page/a/'))
+            self.assertNumQueries(0,
+                lambda: Page.objects.best_match_for_path('/test-page/a/'))
+            self.assertNumQueries(1,
+                lambda: Page.objects.best_match_for_path('/test-page/b/'))
+            self.assertNumQueries(0,
+                lambda: Page.objects.best_match_for_path('/test-page/b/'))
+
+        # Saving the page drops the cached page
+        page.title = 'Changed title'
+        page.save()
+        self.assertEqual(Page.objects.best_match_for_path('/test-page/a/').title,
+            'Changed title')
+
+        # The process-local cache hands out copies
+        feincms_settings.FEINCMS_PAGE_OBJECT_CACHE_SIZE = 10
+        try:
+            object_cache._lru.clear()
+            page1 = Page.objects.best_match_for_path('/test-page/a/')
+            page1._feincms_test = True
+            if hasattr(self, 'assertNumQueries'):
+                self.assertNumQueries(0,
+                    lambda: Page.objects.best_match_for_path('/test-page/a/'))
+            page2 = Page.objects.best_match_for_path('/test-page/a/')
+            self.assertEqual(page1, page2)
+            self.assertFalse(page1 is page2)
+            self.assertFalse(hasattr(page2, '_feincms_test'))
+        finally:
+            feincms_settings.FEINCMS_PAGE_OBJECT_CACHE_SIZE = 0
+            object_cache._lru.clear()
+
+        # The least recently used item is dropped first
+        lru = object_cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_57_cache_namespaces(self):
+        from django.core.cache import cache
+        from feincms.utils import path_to_cache_key
+        from feincms.utils.cache import invalidate_namespace
+
+        self.create_default_page_set()
+        page1 = Page.objects.get(pk=1)
+        page1.active = True
+        page1.save()
+        page2 = Page.objects.get(pk=2)
+        page2.active = True
+        page2.save()
+        page3 = Page.objects.create(title='page3', slug='page3', parent=None)
+
+        cache.clear()
+        self.assertEqual(Page.objects.best_match_for_path(
+            '/test-page/test-child-page/app/'), page2)
+
+        # Moving a subtree drops the resolved paths of all descendants
+        page1 = Page.objects.get(pk=1)
+        page1.parent = page3
+        page1.save()
+        self.assertRaises(Page.DoesNotExist, lambda: Page.objects.best_match_for_path(
+            '/test-page/test-child-page/app/'))
+
+        key = path_to_cache_key('key', namespaces=('test',))
+        self.assertEqual(key, path_to_cache_key('key', namespaces=('test',)))
+        invalidate_namespace('test')
+        self.assertNotEqual(key, path_to_cache_key('key', namespaces=('test',)))
+
+        # The site-wide namespace is part of all namespaced keys
+        key = path_to_cache_key('key', namespaces=('test',))
+        invalidate_namespace('site')
+        self.assertNotEqual(key, path_to_cache_key('key', namespaces=('test',)))
+
+        # Generations outlive the default timeout of the cache
+        import time
+        from django.core.cache.backends import locmem
+        if isinstance(cache, locmem.LocMemCache):
+            key = path_to_cache_key('key', namespaces=('test',))
+
+            class LaterTime(object):
+                def time(self):
+                    return time.time() + cache.default_timeout + 60
+
+            locmem.time = LaterTime()
+            try:
+                self.assertEqual(key, path_to_cache_key('key', namespaces=('test',)))
+            finally:
+                locmem.time = time
+
+    def test_58_host_aware_sites(self):
+        from django.test.client import RequestFactory
+        from feincms.module.page.extensions.sites import SiteMiddleware,\
+            site_for_host
+        from feincms.utils.sites import current_site_id, deactivate_site
+
+        self.login()
+        site_2 = Site.objects.create(name='site 2', domain='2.example.com')
+        self.create_page('site 1 homepage', override_url='/', active=True)
+        self.create_page('site 2 homepage', override_url='/',
+                site=site_2.id, active=True)
+        page1, page2 = Page.objects.order_by('id')
+
+        self.assertEqual(site_for_host('2.EXAMPLE.com:8000'), site_2.id)
+        self.assertEqual(site_for_host('unknown.example.com'), None)
+
+        middleware = SiteMiddleware()
+        factory = RequestFactory()
+        old = feincms_settings.FEINCMS_PAGE_URL_INDEX
+        try:
+            for url_index in (False, True):
+                feincms_settings.FEINCMS_PAGE_URL_INDEX = url_index
+                for host, page in (('2.example.com', page2),
+                        ('unknown.example.com', page1),
+                        ('2.example.com', page2)):
+                    request = factory.get('/', HTTP_HOST=host)
+                    middleware.process_request(request)
+                    self.assertEqual(Page.objects.best_match_for_path('/'), page)
+                    self.assertEqual(Page.objects.page_for_path('/'), page)
+                    middleware.process_response(request, None)
+                    self.assertEqual(current_site_id(), 1)
+
+            # Keys which are invalidated by deleting them are shared by all
+            # sites
+            from feincms.module.extensions import content_cache, datepublisher
+            from feincms.utils.sites import activate_site
+            keys = (content_cache.content_cache_key(page1),
+                datepublisher._transition_key(Page))
+            activate_site(site_2.id)
+            self.assertEqual(keys, (content_cache.content_cache_key(page1),
+                datepublisher._transition_key(Page)))
+            deactivate_site()
+
+            # Streamed responses and content blocks rendered in the thread
+            # pool are rendered for the site of the request
+            from django.template import Context, Template
+            from feincms.utils.templates import stream_template
+
+            class SiteContent(object):
+                feincms_render_threadsafe = True
+
+                def render(self, **kwargs):
+                    return u'%s,' % current_site_id()
+
+            feincms_settings.FEINCMS_RENDER_THREADS = 2
+            activate_site(site_2.id)
+            stream = stream_template(Template('{{ site }}'),
+                Context({'site': current_site_id}))
+            output = feincms_tags._render_contents_concurrently(
+                [SiteContent(), SiteContent()], request=None)
+            deactivate_site()
+            self.assertEqual(u''.join(stream), unicode(site_2.id))
+            self.assertEqual(output, u'%s,%s,' % (site_2.id, site_2.id))
+            self.assertEqual(current_site_id(), 1)
+
+            # Renaming the site is picked up immediately
+            site_2.domain = 'two.example.com'
+            site_2.save()
+            self.assertEqual(site_for_host('two.example.com'), site_2.id)
+        finally:
+            feincms_settings.FEINCMS_PAGE_URL_INDEX = old
+            feincms_settings.FEINCMS_RENDER_THREADS = 0
+            deactivate_site()
+
+    def test_59_bulk_copy_large_page(self):
+        from django.db import connection
+        from feincms.utils import bulk_create
+
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        type = Page.content_type_for(RawContent)
+
+        # More content blocks than SQLite accepts in a single insert
+        bulk_create(type, [type(parent=page, region='main', ordering=i,
+            text='%s,' % i) for i in range(600)])
+        self.assertEqual(page.rawcontent_set.count(), 600)
+
+        page2 = Page.objects.get(pk=2)
+        old = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            page2.copy_content_from(page)
+        finally:
+            connection.use_debug_cursor = old
+
+        if connection.vendor == 'sqlite':
+            # Three batches of 249 rows
+            self.assertEqual(len([q for q in connection.queries[start:]
+                if q['sql'].startswith('INSERT INTO "%s"' % type._meta.db_table)]), 3)
+
+        self.assertEqual(page2.rawcontent_set.count(), 600)
+        self.assertEqual(Page.objects.get(pk=2).content.main[-1].text, '599,')
+
+    def test_60_path_cache_bounded_by_transition(self):
+        from django.core.cache import cache
+        import time
+
+        self.create_default_page_set()
+        page1 = Page.objects.get(pk=1)
+        page1.active = True
+        page1.publication_end_date = datetime.now() + timedelta(minutes=6)
+        page1.save()
+        cache.clear()
+
+        def expires_in(key):
+            return cache._expire_info[cache.make_key(key)] - time.time()
+
+        # The resolved path expires when page1 is unpublished
+        self.assertEqual(Page.objects.best_match_for_path('/test-page/x/'), page1)
+        self.assertTrue(0 < expires_in(Page.path_to_cache_key('/test-page/x/')) <= 360)
+
+        old = feincms_settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT
+        feincms_settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT = 3600
+        try:
+            self.assertRaises(Page.DoesNotExist,
+                lambda: Page.objects.best_match_for_path('/other/'))
+            mk = Page.objects._miss_cache_key('other', 'BEST-MATCH')
+            self.assertTrue(0 < expires_in(mk) <= 360)
+        finally:
+            feincms_settings.FEINCMS_PAGE_MISS_CACHE_TIMEOUT = old
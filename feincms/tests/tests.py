@@ -3,12 +3,14 @@
 # ------------------------------------------------------------------------
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from feincms.content.contactform.models import ContactFormContent, ContactForm
 from feincms.content.file.models import FileContent
+from feincms.content.raw.models import RawContent
 
 from feincms.models import Region, Template, Base
+from feincms.module.extensions.ct_tracker import TrackerContentProxy
 from feincms.module.blog.models import Entry
 from feincms.module.page import processors
 from feincms.module.page.models import Page
@@ -95,6 +97,7 @@ Entry.register_extensions(
     'feincms.module.extensions.translations',
     'feincms.module.extensions.seo',
     'feincms.module.extensions.ct_tracker',
+    'feincms.module.extensions.content_blocks',
     )
 class BlogTestCase(TestCase):
     def setUp(self):
@@ -159,6 +162,71 @@ class BlogTestCase(TestCase):
         self.assertEqual(self.client.get('/admin/blog/entry/').status_code, 200)
         self.assertEqual(self.client.get('/admin/blog/entry/1/').status_code, 200)
 
+    def test_04_content_blocks(self):
+        entry = self.create_entry()
+        entry.rawcontent_set.create(region='main', ordering=1, text=' and more')
+        entry.imagecontent_set.create(region='another', ordering=0,
+            image='somefile.jpg', position='default')
+
+        # The content blocks listed in the ct_tracker inventory are loaded
+        # from the single table
+        self.assertTrue(issubclass(Entry.content_proxy_class, TrackerContentProxy))
+        Entry.objects.get(pk=entry.pk).content.main
+
+        entry = Entry.objects.get(pk=entry.pk)
+        if hasattr(self, 'assertNumQueries'):
+            # All content types are loaded with a single query
+            self.assertNumQueries(1, lambda: [entry.content.main, entry.content.another])
+
+        self.assertEqual(u''.join(c.render() for c in entry.content.main),
+            'Something awful and more')
+        self.assertEqual(entry.content.another[0].image.name, 'somefile.jpg')
+        self.assertEqual(entry.content.main[0].parent, entry)
+
+        # Changes and deletions are reflected in the single table
+        content = entry.rawcontent_set.get(ordering=0)
+        content.text = 'Something nice'
+        content.save()
+        entry.imagecontent_set.all().delete()
+
+        entry = Entry.objects.get(pk=entry.pk)
+        self.assertEqual(u''.join(c.render() for c in entry.content.main),
+            'Something nice and more')
+        self.assertEqual(entry.content.another, [])
+
+        # Copying content uses bulk inserts which do not send post_save
+        entry2 = Entry.objects.create(title='Copy', slug='copy', language='en')
+        entry2.copy_content_from(entry)
+        entry2 = Entry.objects.get(pk=entry2.pk)
+        self.assertEqual(u''.join(c.render() for c in entry2.content.main),
+            'Something nice and more')
+
+        # Proxies which cannot load from the single table are refused
+        from django.core.exceptions import ImproperlyConfigured
+        from feincms.models import ContentProxy
+        from feincms.module.extensions import content_blocks
+
+        class Item(object):
+            content_proxy_class = type('CustomContentProxy', (ContentProxy,), {})
+        self.assertRaises(ImproperlyConfigured, content_blocks.register, Item, None)
+
+    def test_05_content_blocks_large_entry(self):
+        from feincms.module.extensions.content_blocks import rebuild_content_blocks
+        from feincms.utils import bulk_create
+
+        entry = self.create_entry()
+        type = entry.rawcontent_set.model
+
+        # Bulk inserts do not send post_save, rebuild the single table with
+        # more rows than SQLite accepts in a single insert
+        bulk_create(type, [type(parent=entry, region='main', ordering=i + 1,
+            text='.') for i in range(400)])
+        rebuild_content_blocks(entry)
+
+        entry = Entry.objects.get(pk=entry.pk)
+        self.assertEqual(len(entry.content.main), 401)
+        self.assertEqual(entry.content.main[0].render(), 'Something awful')
+
 
 class CleanseTestCase(TestCase):
     def test_01_cleanse(self):
@@ -175,3 +243,18 @@ class CleanseTestCase(TestCase):
 
         for a, b in entries:
             self.assertEqual(cleanse_html(a), b)
+
+
+class IndexesTestCase(TransactionTestCase):
+    # Index introspection commits the current transaction on SQLite
+    def test_01_recommended_indexes(self):
+        from django.db import connection
+        from feincms.management.checker import get_indexes, missing_indexes
+
+        type = Page.content_type_for(RawContent)
+        indexes = get_indexes(connection.cursor(), type._meta.db_table)
+
+        if indexes is not None:
+            self.assertTrue(('parent_id', 'region', 'ordering') in indexes)
+            self.assertEqual(missing_indexes(type), [])
+            self.assertEqual(missing_indexes(Page), [])
@@ -49,6 +49,53 @@ def copy_model_instance(obj, exclude=None):
                        not f in obj._meta.parents.values()])
     return obj.__class__(**initial)
 
+# ------------------------------------------------------------------------
+def bulk_create(model, objs):
+    """
+    Insert the passed instances using ``bulk_create``. Django 1.4 has no
+    ``batch_size`` argument, so the instances are split into batches
+    staying below the limits of SQLite (999 variables and 500 rows per
+    statement).
+    """
+
+    from django.db import connections, router
+
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == 'sqlite':
+        fields = len([f for f in model._meta.local_fields
+            if not isinstance(f, AutoField)])
+        batch_size = max(1, min(500, 999 // max(fields, 1)))
+    else:
+        batch_size = len(objs) or 1
+
+    for i in range(0, len(objs), batch_size):
+        model.objects.bulk_create(objs[i:i + batch_size])
+
+# ------------------------------------------------------------------------
+def tree_position_changed(instance):
+    """
+    Determines whether the passed object has been moved in the tree by the
+    save which is currently in progress.
+    """
+
+    opts = getattr(instance, '_mptt_meta', None)
+    cached_fields = getattr(instance, '_mptt_cached_fields', None)
+    if opts is None or cached_fields is None:
+        # Not a django-mptt model, assume the worst
+        return True
+
+    # The cached fields still hold the values from before the save
+    if cached_fields.get(opts.parent_attr) != opts.get_raw_field_value(
+            instance, opts.parent_attr):
+        return True
+
+    # The tree editor moves nodes using the tree manager, which does not
+    # update the cached fields; the changed URL of pages gives it away.
+    if hasattr(instance, '_original_cached_url'):
+        return instance._cached_url != instance._original_cached_url
+
+    return False
+
 # ------------------------------------------------------------------------
 def shorten_string(str, max_length=50):
     """
@@ -66,16 +113,29 @@ def shorten_string(str, max_length=50):
     return str
 
 # ------------------------------------------------------------------------
-def path_to_cache_key(path, max_length=200, prefix=""):
+def path_to_cache_key(path, max_length=200, prefix="", namespaces=(),
+        site_id=None):
     """
     Convert a string (path) into something that can be fed to django's
     cache mechanism as cache key. Ensure the string stays below the
     max key size, so if too long, hash it and use that instead.
+
+    If ``namespaces`` are passed, their current generations are folded into
+    the key, so that all keys of a namespace can be invalidated at once using
+    ``feincms.utils.cache.invalidate_namespace``.
+
+    Keys are specific to the site served by the current thread (see
+    ``feincms.utils.sites``) unless another ``site_id`` is passed.
     """
 
     from django.utils.encoding import iri_to_uri
     path = iri_to_uri(path)
 
+    if namespaces:
+        from feincms.utils.cache import cache_generations
+        path = u'%s:%s' % (
+            '-'.join(str(g) for g in cache_generations(namespaces)), path)
+
     # logic below borrowed from http://richwklein.com/2009/08/04/improving-django-cache-part-ii/
     # via acdha's django-sugar
     if len(path) > max_length:
@@ -83,7 +143,11 @@ def path_to_cache_key(path, max_length=200, prefix=""):
         m.update(path)
         path = m.hexdigest() + '-' + path[:max_length - 20]
 
-    cache_key = 'FEINCMS:%d:%s:%s' % (django_settings.SITE_ID, prefix, path)
+    if site_id is None:
+        from feincms.utils.sites import current_site_id
+        site_id = current_site_id()
+
+    cache_key = 'FEINCMS:%d:%s:%s' % (site_id, prefix, path)
     return cache_key
 
 # ------------------------------------------------------------------------
@@ -0,0 +1,153 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Caching of the rendered output of content blocks.
+
+Content types opt into caching by defining ``feincms_cache_timeout`` (in
+seconds). The rendered output varies on the values listed in
+``feincms_cache_vary_on``, which may contain ``'language'`` (the active
+language), ``'path'`` (the request path), ``'user'`` (the primary key of
+the current user) or callables receiving the content block and the request::
+
+    class TeaserContent(models.Model):
+        feincms_cache_timeout = 600
+        feincms_cache_vary_on = ('language',)
+
+        class Meta:
+            abstract = True
+
+        def render(self, **kwargs):
+            ...
+
+Cached output is invalidated when the content block is saved or deleted.
+Output rendered for frontend editing is never cached.
+
+Whole classes of cache keys are invalidated using namespaces: Every
+namespace has a generation stored in the cache which is folded into the
+keys created by ``path_to_cache_key(..., namespaces=...)``. Invalidating a
+namespace starts a new generation, the old keys are never used again and
+expire eventually. The site-wide namespace ``'site'`` is part of every such
+key. ``model_namespace`` and ``object_namespace`` return the namespaces of
+all objects of a model and of a single object respectively.
+"""
+
+import time
+
+from django.conf import settings as django_settings
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import translation
+
+from feincms.utils import path_to_cache_key
+
+
+#: Versions are kept much longer than the cache's default timeout, every
+#: expired version invalidates all cache keys containing it
+VERSION_TIMEOUT = 30 * 24 * 60 * 60
+
+# ------------------------------------------------------------------------
+def cache_version(key):
+    """
+    Returns the version stored in the cache under ``key``, creating a new
+    version if there is none. Cache keys containing the version are
+    invalidated all at once by deleting ``key``. Returns ``None`` if the cache
+    does not store anything (f.e. with the dummy cache backend).
+    """
+
+    version = django_cache.get(key)
+    if version is None:
+        django_cache.add(key, repr(time.time()), VERSION_TIMEOUT)
+        version = django_cache.get(key)
+    return version
+
+# ------------------------------------------------------------------------
+def model_namespace(model):
+    return model._meta.db_table
+
+def object_namespace(model, pk):
+    return u'%s-%s' % (model._meta.db_table, pk)
+
+def _generation_key(namespace):
+    # Generations are shared by all sites served by this installation
+    return path_to_cache_key(namespace, prefix='GENERATION',
+        site_id=django_settings.SITE_ID)
+
+def cache_generations(namespaces):
+    """
+    Returns the current generations of the site-wide namespace and of the
+    passed namespaces, using a single cache round trip unless new generations
+    have to be started.
+    """
+
+    keys = [_generation_key(ns) for ns in ('site',) + tuple(namespaces)]
+    found = django_cache.get_many(keys)
+    return [found.get(key) or cache_version(key) for key in keys]
+
+def invalidate_namespace(*namespaces):
+    """
+    Invalidates all cache keys of the passed namespaces
+    """
+
+    django_cache.delete_many([_generation_key(ns) for ns in namespaces])
+
+def _vary_on_value(vary, content, request):
+    if callable(vary):
+        return vary(content, request)
+    elif vary == 'language':
+        return translation.get_language()
+    elif vary == 'path':
+        return request and request.path
+    elif vary == 'user':
+        user = getattr(request, 'user', None)
+        return user and user.is_authenticated() and user.pk or 'anonymous'
+    raise ImproperlyConfigured, '%s cannot vary on %r' % (
+        content.__class__.__name__, vary)
+
+def render_cache_key(content, request=None):
+    """
+    Returns the cache key for the rendered output of the passed content block
+    or ``None`` if the output of this content type should not be cached.
+    """
+
+    if getattr(content, 'feincms_cache_timeout', None) is None or not content.pk:
+        return None
+
+    key = [content._meta.db_table, content.pk]
+    key.extend(_vary_on_value(vary, content, request)
+        for vary in getattr(content, 'feincms_cache_vary_on', ()))
+
+    return path_to_cache_key(u'-'.join(unicode(part) for part in key),
+        prefix='CONTENT-RENDER',
+        namespaces=(object_namespace(content.__class__, content.pk),))
+
+def render_content_cached(content, **kwargs):
+    """
+    Return the rendered output of the content block, using the cache if the
+    content type allows it.
+    """
+
+    ck = render_cache_key(content, kwargs.get('request'))
+    if ck:
+        output = django_cache.get(ck)
+        if output is not None:
+            return output
+
+    output = content.render(**kwargs)
+
+    if ck and output is not None:
+        django_cache.set(ck, output, content.feincms_cache_timeout)
+    return output
+
+# ------------------------------------------------------------------------
+def invalidate_rendered_content(sender, instance, **kwargs):
+    """
+    ``post_save`` and ``post_delete`` handler dropping the cached output of
+    content blocks.
+    """
+
+    if getattr(sender, 'feincms_cache_timeout', None) is not None:
+        invalidate_namespace(object_namespace(sender, instance.pk))
+
+# ------------------------------------------------------------------------
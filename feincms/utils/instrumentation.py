@@ -0,0 +1,81 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Instrumentation of content block processing.
+
+The phases of handling content blocks are wrapped with ``measure``, which
+sends the ``feincms.signals.content_measured`` signal after the phase has
+finished. The following phases are measured:
+
+* ``counts``: Determining the content types used by a CMS object; the sender
+  is the CMS base model.
+* ``load``: Loading the content blocks of one content type; the sender is
+  the content type.
+* ``process``, ``finalize`` and ``render``: Calling the respective method of
+  a single content block; the sender is the content type.
+
+Receivers get the ``phase``, the ``instance`` (the CMS object or the content
+block, if available), the wall time in seconds as ``duration`` and the
+number of database queries as ``queries``::
+
+    from feincms.signals import content_measured
+
+    def log_slow_content(sender, phase, duration, queries, **kwargs):
+        if duration > 0.1:
+            logger.warning('%s %s: %.3fs, %d queries', sender.__name__,
+                phase, duration, queries)
+
+    content_measured.connect(log_slow_content)
+
+Nothing is measured as long as no receivers are connected. Queries are counted
+on the default database; the queries executed while measuring are recorded in
+``connection.queries`` even if ``DEBUG`` is ``False``.
+"""
+
+from __future__ import with_statement
+
+import time
+
+from django.db import connection
+
+from feincms.signals import content_measured
+
+
+# ------------------------------------------------------------------------
+class measure(object):
+    """
+    Context manager measuring the wall time and the number of queries of the
+    enclosed block::
+
+        with measure(content.__class__, 'render', instance=content):
+            content.render(request=request)
+    """
+
+    def __init__(self, sender, phase, instance=None):
+        self.sender = sender
+        self.phase = phase
+        self.instance = instance
+        self.active = False
+
+    def __enter__(self):
+        if content_measured.receivers:
+            self.active = True
+            self.use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            self.queries = len(connection.queries)
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.active:
+            duration = time.time() - self.start
+            queries = len(connection.queries) - self.queries
+            connection.use_debug_cursor = self.use_debug_cursor
+
+            content_measured.send(sender=self.sender, phase=self.phase,
+                instance=self.instance, duration=duration, queries=queries)
+        return False
+
+# ------------------------------------------------------------------------
@@ -15,11 +15,14 @@ class ActiveAwareContentManagerMixin(object):
     active_filters = {}
 
     @classmethod
-    def apply_active_filters(cls, queryset):
+    def apply_active_filters(cls, queryset, exclude=()):
         """
         Apply all filters defined to the queryset passed and return the result.
+        Filters whose keys are listed in ``exclude`` are skipped.
         """
-        for filt in cls.active_filters.values():
+        for key, filt in cls.active_filters.items():
+            if key in exclude:
+                continue
             if callable(filt):
                 queryset = filt(queryset)
             else:
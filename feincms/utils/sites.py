@@ -0,0 +1,62 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+The site served by the current thread.
+
+By default, this is the site configured using ``SITE_ID``. The
+``SiteMiddleware`` of the :mod:`~feincms.module.page.extensions.sites`
+extension activates the site matching the host of every request instead, so
+that a single process can serve many sites. Cache keys created by
+``feincms.utils.path_to_cache_key`` and the active filter of the ``sites``
+extension use the site returned by ``current_site_id``.
+"""
+
+from django.conf import settings as django_settings
+
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
+
+
+_local = local()
+
+
+# ------------------------------------------------------------------------
+def current_site_id():
+    """
+    Returns the ID of the site activated for the current thread or
+    ``SITE_ID`` if no site has been activated.
+    """
+
+    return getattr(_local, 'site_id', None) or django_settings.SITE_ID
+
+def activate_site(site_id):
+    _local.site_id = site_id
+
+def deactivate_site():
+    _local.site_id = None
+
+class override_site(object):
+    """
+    Context manager activating the passed site for the enclosed block and
+    restoring the previously activated site afterwards. Used to hand the
+    site over to code running later or in other threads, f.e. when
+    streaming responses.
+    """
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'site_id', None)
+        activate_site(self.site_id)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        activate_site(self.previous)
+        return False
+
+# ------------------------------------------------------------------------
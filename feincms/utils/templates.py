@@ -0,0 +1,119 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+
+"""
+Incremental template rendering.
+
+``stream_template`` renders a template node by node and yields the output
+of every top-level node as soon as it is available. Template inheritance is
+followed, that is, ``{% extends %}`` and ``{% block %}`` tags are expanded and
+their contents are streamed too. All other tags (f.e. ``{% include %}`` or
+``{% feincms_render_region %}``) are rendered as a whole.
+"""
+
+from __future__ import with_statement
+
+from django.db import connections
+from django.template.base import Node, TextNode
+from django.template.loader_tags import BLOCK_CONTEXT_KEY, BlockContext,\
+    BlockNode, ExtendsNode
+from django.utils import translation
+from django.utils.encoding import force_unicode
+
+from feincms.utils.sites import current_site_id, override_site
+
+
+# ------------------------------------------------------------------------
+def _stream_nodelist(nodelist, context):
+    for node in nodelist:
+        if isinstance(node, ExtendsNode):
+            for bit in _stream_extends(node, context):
+                yield bit
+        elif isinstance(node, BlockNode):
+            for bit in _stream_block(node, context):
+                yield bit
+        elif isinstance(node, Node):
+            yield force_unicode(nodelist.render_node(node, context))
+        else:
+            yield force_unicode(node)
+
+def _stream_extends(node, context):
+    # Mirrors ExtendsNode.render
+    compiled_parent = node.get_parent(context)
+
+    if BLOCK_CONTEXT_KEY not in context.render_context:
+        context.render_context[BLOCK_CONTEXT_KEY] = BlockContext()
+    block_context = context.render_context[BLOCK_CONTEXT_KEY]
+
+    block_context.add_blocks(node.blocks)
+
+    for parent_node in compiled_parent.nodelist:
+        if not isinstance(parent_node, TextNode):
+            if not isinstance(parent_node, ExtendsNode):
+                block_context.add_blocks(dict([(n.name, n) for n in
+                    compiled_parent.nodelist.get_nodes_by_type(BlockNode)]))
+            break
+
+    for bit in _stream_nodelist(compiled_parent.nodelist, context):
+        yield bit
+
+def _stream_block(node, context):
+    # Mirrors BlockNode.render
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    context.push()
+    push = None
+
+    if block_context is None:
+        context['block'] = node
+        nodelist = node.nodelist
+    else:
+        push = block = block_context.pop(node.name)
+        if block is None:
+            block = node
+        block = BlockNode(block.name, block.nodelist)
+        block.context = context
+        context['block'] = block
+        nodelist = block.nodelist
+
+    for bit in _stream_nodelist(nodelist, context):
+        yield bit
+
+    if push is not None:
+        block_context.push(node.name, push)
+    context.pop()
+
+# ------------------------------------------------------------------------
+def stream_template(template, context):
+    """
+    Return a generator yielding the output of ``template`` rendered with
+    ``context`` piece by piece.
+
+    The output is rendered after the middleware has processed the response.
+    The language and the site served by the current thread (see
+    ``feincms.utils.sites``) are captured now and activated while rendering.
+
+    Django sends ``request_finished`` and closes the database connections
+    before the response is iterated. Database connections opened while
+    rendering (f.e. by lazily evaluated querysets) are therefore closed
+    again once the output has been rendered completely.
+    """
+
+    return _stream_template(template, context, translation.get_language(),
+        current_site_id())
+
+def _stream_template(template, context, language, site_id):
+    # Runs on the first iteration, after the request has been finished
+    closed = [c for c in connections.all() if c.connection is None]
+    context.render_context.push()
+    try:
+        with translation.override(language):
+            with override_site(site_id):
+                for bit in _stream_nodelist(template.nodelist, context):
+                    yield bit
+    finally:
+        context.render_context.pop()
+        for c in closed:
+            c.close()
+
+# ------------------------------------------------------------------------
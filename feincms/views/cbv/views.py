@@ -1,10 +1,15 @@
-from django.http import Http404
-from django.template import Template
+from __future__ import with_statement
+
+from django.http import Http404, HttpResponse
+from django.template import RequestContext, Template
+from django.template.loader import select_template
 from django.utils.cache import add_never_cache_headers
 from django.views.generic import TemplateView
 
 from feincms import settings
 from feincms.module.page.models import Page
+from feincms.utils.instrumentation import measure
+from feincms.utils.templates import stream_template
 
 
 class HandlerBase(TemplateView):
@@ -12,6 +17,12 @@ class HandlerBase(TemplateView):
     Class-based handler for FeinCMS page content
     """
 
+    #: Send the page to the client while the template is still being rendered
+    #: instead of building the whole response in memory first. Response
+    #: processors and ``finalize`` methods of content types must not access
+    #: ``response.content`` when streaming, neither may any middleware.
+    streaming = False
+
     def get(self, request, *args, **kwargs):
         return self.handler(request, *args, **kwargs)
 
@@ -27,6 +38,19 @@ class HandlerBase(TemplateView):
         response = self.render_to_response(self.get_context_data())
         return self.finalize(response)
 
+    def render_to_response(self, context, **response_kwargs):
+        if not self.streaming:
+            return super(HandlerBase, self).render_to_response(context,
+                **response_kwargs)
+
+        template = self.get_template_names()
+        if not isinstance(template, Template):
+            template = select_template(template)
+
+        return HttpResponse(
+            stream_template(template, RequestContext(self.request, context)),
+            **response_kwargs)
+
     def get_template_names(self):
         # According to the documentation this method is supposed to return
         # a list. However, we can also return a Template instance...
@@ -56,7 +80,8 @@ class HandlerBase(TemplateView):
 
         for content in self.page.content.all_of_type(tuple(self.page._feincms_content_types_with_process)):
             try:
-                r = content.process(self.request, view=self)
+                with measure(content.__class__, 'process', instance=content):
+                    r = content.process(self.request, view=self)
                 if r in (True, False):
                     successful = r
                 elif r:
@@ -80,7 +105,8 @@ class HandlerBase(TemplateView):
         """
 
         for content in self.page.content.all_of_type(tuple(self.page._feincms_content_types_with_finalize)):
-            r = content.finalize(self.request, response)
+            with measure(content.__class__, 'finalize', instance=content):
+                r = content.finalize(self.request, response)
             if r:
                 return r
 
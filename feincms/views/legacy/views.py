@@ -1,3 +1,5 @@
+from __future__ import with_statement
+
 from django.http import Http404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
@@ -5,6 +7,7 @@ from django.utils.cache import add_never_cache_headers
 
 from feincms import settings
 from feincms.module.page.models import Page
+from feincms.utils.instrumentation import measure
 
 
 class Handler(object):
@@ -48,7 +51,8 @@ class Handler(object):
 
         for content in page.content.all_of_type(tuple(page._feincms_content_types_with_process)):
             try:
-                r = content.process(request)
+                with measure(content.__class__, 'process', instance=content):
+                    r = content.process(request)
                 if r in (True, False):
                     successful = r
                 elif r:
@@ -85,7 +89,8 @@ class Handler(object):
         """
 
         for content in page.content.all_of_type(tuple(page._feincms_content_types_with_finalize)):
-            r = content.finalize(request, response)
+            with measure(content.__class__, 'finalize', instance=content):
+                r = content.finalize(request, response)
             if r:
                 return r
 